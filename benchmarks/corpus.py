@@ -0,0 +1,127 @@
+"""Generates the synthetic corpus the benchmarks search."""
+
+import os
+import random
+
+# Same seed, same corpus, runs on different days can be compared
+seed = 1
+
+# Term every search looks for, in about one of needle_rate lines
+needle = 'ERROR'
+needle_rate = 50
+
+words = ('alpha', 'beta', 'gamma', 'delta', 'request', 'response', 'user',
+         'session', 'timeout', 'cache', 'disk', 'queue', 'worker', 'retry',
+         'INFO', 'DEBUG', 'WARN', 'connection', 'closed', 'opened', 'id',
+         'value', 'the', 'a', 'of', 'to', 'in', '0', '42', '1337', 'ok')
+
+
+def make_lines(rng, count, words_per_line=12):
+    """Returns count log like lines, some of them containing the needle."""
+
+    lines = []
+    for i in range(count):
+        line = ' '.join(rng.choice(words) for _ in range(words_per_line))
+        if rng.randrange(needle_rate) == 0:
+            line += ' ' + needle + ' ' + str(rng.randrange(1000))
+
+        lines.append('{:08d} {}\n'.format(i, line))
+
+    return ''.join(lines).encode('ascii')
+
+
+def write_file(path, data):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def make_tiny_files(rng, directory, scale):
+    """Many files of a few lines in a flat tree."""
+
+    for i in range(int(5000 * scale)):
+        write_file(
+            os.path.join(directory, 'dir{:02d}'.format(i % 50),
+                         'file{:05d}.log'.format(i)),
+            make_lines(rng, rng.randrange(1, 8)))
+
+
+def make_huge_files(rng, directory, scale):
+    """A few files of tens of megabytes."""
+
+    # Generating every line is slow, vary a block of them instead
+    block = make_lines(rng, 10000)
+    for i in range(2):
+        with open(os.path.join(directory, 'huge{}.log'.format(i)), 'wb') as f:
+            for _ in range(int(32 * 1024 * 1024 * scale) // len(block)):
+                offset = block.index(b'\n', rng.randrange(len(block))) + 1
+                f.write(block[offset:] + block[:offset])
+
+
+def make_deep_tree(rng, directory, scale):
+    """Directories nested deeply with a few files on every level."""
+
+    for branch in range(max(1, int(4 * scale))):
+        path = os.path.join(directory, 'branch{}'.format(branch))
+        for depth in range(30):
+            path = os.path.join(path, 'level{:02d}'.format(depth))
+            for i in range(10):
+                write_file(
+                    os.path.join(path, 'file{}.txt'.format(i)),
+                    make_lines(rng, rng.randrange(5, 50)))
+
+
+def make_binary_mix(rng, directory, scale):
+    """Text files mixed with binary files which contain the needle, too."""
+
+    for i in range(int(500 * scale)):
+        data = make_lines(rng, rng.randrange(10, 200))
+        if i % 2:
+            data = (bytes(bytearray(rng.randrange(256) for _ in range(512))) +
+                    b'\x00' + data)
+
+        write_file(os.path.join(directory, 'file{:04d}.bin'.format(i)), data)
+
+
+def make_long_lines(rng, directory, scale):
+    """Files with lines of a megabyte."""
+
+    for i in range(max(1, int(20 * scale))):
+        words = make_lines(rng, 20000, words_per_line=1).replace(b'\n', b' ')
+        # Generating every word is slow, repeat them for two lines
+        line = words * ((2 << 20) // len(words) + 1)
+        write_file(
+            os.path.join(directory, 'long{:02d}.txt'.format(i)),
+            line[:1 << 20] + b'\n' + line[1 << 20:2 << 20] + b'\n')
+
+
+profiles = (('tiny_files', make_tiny_files), ('huge_files', make_huge_files),
+            ('deep_tree', make_deep_tree), ('binary_mix', make_binary_mix),
+            ('long_lines', make_long_lines))
+
+
+def generate(directory, scale=1.0):
+    """
+            Writes every profile to its own subdirectory of directory
+            unless it is there already.
+            Returns {profile name: directory of the profile}.
+    """
+
+    profile_dirs = {}
+    for name, make_profile in profiles:
+        profile_dir = os.path.join(directory, '{}-{}'.format(name, scale))
+        if not os.path.isdir(profile_dir):
+            # Written next to it first, an interrupted run is regenerated
+            temp_dir = profile_dir + '.tmp'
+            if not os.path.isdir(temp_dir):
+                os.makedirs(temp_dir)
+
+            make_profile(random.Random(seed), temp_dir, scale)
+            os.rename(temp_dir, profile_dir)
+
+        profile_dirs[name] = profile_dir
+
+    return profile_dirs
@@ -0,0 +1,221 @@
+"""
+Runs every search mode of simple_grep on the synthetic corpus and reports
+throughput and peak memory, the results are stored as JSON.
+
+usage: python -m benchmarks.run [--corpus DIR] [--scale N] [--repeat N]
+                                [--output FILE] [--compare FILE]
+"""
+
+import getopt
+import json
+import os
+import platform
+import pty
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import corpus
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+results_dir = os.path.join(package_dir, 'benchmarks', 'results')
+
+# (name, arguments of simple_grep), stdin modes get the largest file as input
+modes = (('literal', ['-r', corpus.needle]),
+         ('regex', ['-r', '-e', corpus.needle + r' [0-9]+$']),
+         ('line_numbers', ['-rn', corpus.needle]),
+         ('workers', ['-r', '-j', '4', corpus.needle]),
+         ('count', ['-rc', corpus.needle]),
+         ('stdin', [corpus.needle]),
+         ('stdin_line_numbers', ['-n', corpus.needle]))
+
+# Modes searching in a pool of processes, the peak RSS of the main process
+# leaves out the pool and isn't reported for them
+multi_process_modes = ('workers', )
+
+
+def get_size(directory):
+    """Returns (number of files, bytes, largest file) below directory."""
+
+    files = 0
+    size = 0
+    largest = (-1, None)
+    for root, _, names in os.walk(directory):
+        for name in names:
+            file_size = os.path.getsize(os.path.join(root, name))
+            files += 1
+            size += file_size
+            largest = max(largest, (file_size, os.path.join(root, name)))
+
+    return files, size, largest[1]
+
+
+def measure(args, directory, stdin_path=None):
+    """
+            Runs simple_grep once, returns (seconds, peak RSS of the main
+            process in KiB).
+            The output goes to /dev/null.
+    """
+
+    env = dict(os.environ, PYTHONPATH=package_dir)
+    with open(os.devnull, 'wb') as devnull:
+        if stdin_path is None:
+            # A terminal as stdin, otherwise stdin would be searched
+            stdin_master, stdin = pty.openpty()
+            args = args + [directory]
+        else:
+            stdin_master = None
+            stdin = open(stdin_path, 'rb')
+
+        try:
+            start = time.time()
+            process = subprocess.Popen(
+                [sys.executable, '-m', 'grep', '--color', 'never'] + args,
+                stdin=stdin,
+                stdout=devnull,
+                env=env)
+            # wait4 gives the resource usage of this process, not of
+            # every other process the benchmarks started
+            _, status, usage = os.wait4(process.pid, 0)
+            seconds = time.time() - start
+            # Already waited for, Popen must not wait again
+            process.returncode = status
+
+        finally:
+            if stdin_master is None:
+                stdin.close()
+            else:
+                os.close(stdin)
+                os.close(stdin_master)
+
+    # 1 means nothing matched, anything else is a failed run
+    if not os.WIFEXITED(status) or os.WEXITSTATUS(status) not in (0, 1):
+        raise RuntimeError('simple_grep %s failed with status %d'
+                           % (' '.join(args), status))
+
+    # ru_maxrss is in bytes on macOS
+    peak_rss = usage.ru_maxrss
+    if sys.platform == 'darwin':
+        peak_rss //= 1024
+
+    return seconds, peak_rss
+
+
+def run_benchmarks(profile_dirs, repeat):
+    results = []
+    for profile, directory in sorted(profile_dirs.items()):
+        files, size, largest = get_size(directory)
+        for mode, args in modes:
+            is_stdin = mode.startswith('stdin')
+            if is_stdin:
+                files, size = 1, os.path.getsize(largest)
+
+            runs = [
+                measure(args, directory, largest if is_stdin else None)
+                for _ in range(repeat)
+            ]
+            seconds = min(run[0] for run in runs)
+            peak_rss = None
+            if mode not in multi_process_modes:
+                peak_rss = max(run[1] for run in runs)
+
+            result = {
+                'profile': profile,
+                'mode': mode,
+                'args': args,
+                'files': files,
+                'bytes': size,
+                'seconds': seconds,
+                'mb_per_s': size / seconds / 1e6,
+                'files_per_s': files / seconds,
+                'peak_rss_kib': peak_rss
+            }
+            results.append(result)
+            print_result(result)
+
+    return results
+
+
+def print_result(result, previous=None):
+    line = ('{profile:<12} {mode:<20} {seconds:8.3f}s {mb_per_s:9.1f} MB/s '
+            '{files_per_s:10.1f} files/s'.format(**result))
+    if result['peak_rss_kib'] is None:
+        line += '{:>13}'.format('-')
+    else:
+        line += ' {:8d} KiB'.format(result['peak_rss_kib'])
+    if previous is not None:
+        line += '  {:5.2f}x'.format(previous['seconds'] / result['seconds'])
+
+    print(line)
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=package_dir).decode('ascii').strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous_path):
+    """Prints the speedup of every benchmark over an earlier run."""
+
+    with open(previous_path) as f:
+        previous = dict(((r['profile'], r['mode']), r)
+                        for r in json.load(f)['results'])
+
+    print('')
+    print('Compared to ' + previous_path + ':')
+    for result in results:
+        print_result(result, previous.get((result['profile'],
+                                           result['mode'])))
+
+
+def main():
+    optlist, _ = getopt.getopt(
+        sys.argv[1:], '', ['corpus=', 'scale=', 'repeat=', 'output=',
+                           'compare='])
+    options = dict(optlist)
+
+    corpus_dir = options.get(
+        '--corpus', os.path.join(tempfile.gettempdir(), 'simple_grep_corpus'))
+    scale = float(options.get('--scale', 1.0))
+    repeat = int(options.get('--repeat', 3))
+
+    profile_dirs = corpus.generate(corpus_dir, scale)
+    results = run_benchmarks(profile_dirs, repeat)
+
+    report = {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': scale,
+        'repeat': repeat,
+        'results': results
+    }
+
+    output = options.get('--output')
+    if output is None:
+        if not os.path.isdir(results_dir):
+            os.makedirs(results_dir)
+
+        output = os.path.join(
+            results_dir, time.strftime('%Y%m%d-%H%M%S') + '.json')
+
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    print('')
+    print('Results written to ' + output)
+
+    if '--compare' in options:
+        compare(results, options['--compare'])
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,14 @@
+import codecs
 import os
+import re
+import stat
 import sys
-import tempfile
-import select
-import platform
 
 import getopt
 from . import grep as grep_
+from . import path_filter
+from . import print_helper
+from . import stats
 
 
 empty_string = ''
@@ -15,6 +18,31 @@ search_recursively_key   = 'search_recursively'
 full_paths_key           = 'full_paths'
 do_regex_search_key      = 'do_regex_search'
 display_line_numbers_key = 'display_line_numbers'
+workers_key              = 'workers'
+patterns_key             = 'patterns'
+build_index_key          = 'build_index'
+use_index_key            = 'use_index'
+watch_index_key          = 'watch_index'
+serve_key                = 'serve'
+connect_key              = 'connect'
+cache_size_key           = 'cache_size'
+include_key              = 'include'
+exclude_key              = 'exclude'
+exclude_dir_key          = 'exclude_dir'
+use_ignore_files_key     = 'use_ignore_files'
+color_key                = 'color'
+max_count_key            = 'max_count'
+list_files_key           = 'list_files'
+is_quiet_key             = 'is_quiet'
+count_mode_key           = 'count_mode'
+show_stats_key           = 'show_stats'
+encoding_key             = 'encoding'
+errors_key               = 'errors'
+decompress_key           = 'decompress'
+search_archives_key      = 'search_archives'
+before_context_key       = 'before_context'
+after_context_key        = 'after_context'
+show_patterns_key        = 'show_patterns'
 
 def usage():
     import subprocess
@@ -28,11 +56,19 @@ def usage():
     print('simple_grep')
     # print('simple_grep, version ' + version.decode('utf-8'))
     print('')
-    print('usage: simple_grep [-rnpe] [SEARCH_TERM] [FILE_TO_SEARCH]')
+    print('usage: simple_grep [-rnpelLqcz] [-j N] [-m NUM] [-A NUM] [-B NUM] '
+          '[-C NUM]')
+    print('                   [SEARCH_TERM] [FILE_TO_SEARCH]')
+    print('       simple_grep [-rnpelLqcz] [-j N] [-m NUM] [-A NUM] [-B NUM] '
+          '[-C NUM]')
+    print('                   -f PATTERN_FILE [FILE_TO_SEARCH]')
+    print('       simple_grep [-r] --build-index DIRECTORY')
+    print('       simple_grep [-r] --watch-index DIRECTORY')
+    print('       simple_grep --serve SOCKET [--cache-size BYTES]')
     print('')
     print('Arguments:')
     print('  SEARCH_TERM')
-    print('  FILE_TO_SEARCH')
+    print('  FILE_TO_SEARCH    A file or directory, - is stdin.')
     print('')
     print('Options:')
     print('  -h --help         ')
@@ -40,6 +76,56 @@ def usage():
     print('  --full            Display full/absolute paths for matches.')
     print('  -e                Use the search term as a regex pattern.')
     print('  -n                Display line numbers for matches.')
+    print('  -j N              Search files using N worker processes.')
+    print('  -f PATTERN_FILE   Search for every line of PATTERN_FILE at once.')
+    print('  --show-patterns   Print the patterns of PATTERN_FILE found in a')
+    print('                    line in front of it.')
+    print('  -l                Only print the names of files with matches.')
+    print('  -L                Only print the names of files without matches.')
+    print('  -q                Print nothing, exit with status 0 on the first')
+    print('                    match and with status 1 if nothing matches.')
+    print('  -m NUM            Stop reading a file after NUM matching lines.')
+    print('  -A NUM            Print NUM lines after every matched line.')
+    print('  -B NUM            Print NUM lines before every matched line.')
+    print('  -C NUM            Print NUM lines before and after every matched')
+    print('                    line, groups of lines are separated by --.')
+    print('  -c --count        Only print the number of matching lines of')
+    print('                    every file.')
+    print('  --count-matches   Only print the number of matches of every file.')
+    print('  -z                Search the contents of gzip, bzip2 and xz files.')
+    print('  --search-archives Search the files in zip and tar archives, as')
+    print('                    ARCHIVE!/MEMBER, without extracting them.')
+    print('  --encoding ENC    Encoding of the searched files (default utf-8),')
+    print('                    only null bytes mark binary files then.')
+    print('  --errors HANDLER  What to do with matched lines which can\'t be')
+    print('                    decoded: strict (skip the file, default),')
+    print('                    replace, ignore, backslashreplace, ...')
+    print('  --stats           Print counters and the time spent in every stage')
+    print('                    of the search to stderr.')
+    print('  --include GLOB    Only search files whose name matches GLOB.')
+    print('  --exclude GLOB    Skip files whose name matches GLOB.')
+    print('  --exclude-dir GLOB')
+    print('                    Skip directories whose name matches GLOB.')
+    print('  --ignore-files    Skip what .gitignore and .ignore files list.')
+    print('  --color WHEN      Color output always, never or auto (default),')
+    print('                    auto colors if stdout is a terminal.')
+    print('  --build-index DIRECTORY')
+    print('                    Build the search index of DIRECTORY.')
+    print('  --watch-index DIRECTORY')
+    print('                    Keep the search index of DIRECTORY up to date.')
+    print('  --index           Only search files the index says can match.')
+    print('                    Falls back to a full search if it is stale.')
+    print('  --serve SOCKET    Answer searches on the Unix socket SOCKET.')
+    print('  --cache-size BYTES')
+    print('                    Keep up to BYTES of file contents in memory.')
+    print('  --connect SOCKET  Let the server on SOCKET run the search.')
+
+
+def read_pattern_file(file_path):
+    """Reads one search pattern per line."""
+
+    with open(file_path, 'r') as f:
+        return f.read().splitlines()
 
 
 def parse_command_line_options():
@@ -47,16 +133,53 @@ def parse_command_line_options():
     full_paths           = False
     do_regex_search      = False
     display_line_numbers = False
+    workers              = 1
+    patterns             = None
+    build_index          = None
+    use_index            = False
+    watch_index          = None
+    serve                = None
+    connect              = None
+    cache_size           = 0
+    include              = []
+    exclude              = []
+    exclude_dir          = []
+    use_ignore_files     = False
+    color                = 'auto'
+    max_count            = None
+    list_files           = None
+    is_quiet             = False
+    count_mode           = None
+    show_stats           = False
+    encoding             = None
+    errors               = 'strict'
+    decompress           = False
+    search_archives      = False
+    before_context       = None
+    after_context        = None
+    context              = 0
+    show_patterns        = False
     
     try:
-        optlist, args = getopt.getopt(sys.argv[1:], 'hren',
-                                      ['help', 'full'])
+        optlist, args = getopt.getopt(sys.argv[1:], 'hrenj:f:lLqm:czA:B:C:',
+                                      ['help', 'full', 'build-index=',
+                                       'watch-index=', 'index', 'serve=',
+                                       'connect=', 'cache-size=', 'include=',
+                                       'exclude=', 'exclude-dir=',
+                                       'ignore-files', 'color=', 'count',
+                                       'count-matches', 'stats', 'encoding=',
+                                       'errors=', 'search-archives',
+                                       'show-patterns'])
 
     except getopt.GetoptError as err:
         print(str(err))
         usage()
         raise KeyboardInterrupt
 
+    if any(o == '-f' for o, _ in optlist):
+        # The patterns take the place of the search term
+        args.insert(0, empty_string)
+
     if len(args) < 1:
         args = [empty_string, empty_string]
     elif len(args) == 1:
@@ -68,18 +191,166 @@ def parse_command_line_options():
             sys.exit(0)
         elif o in ('-r'):
             search_recursively = True
-        elif o in ('--full'):
+        elif o == '--full':
             full_paths = True
+        elif o == '--build-index':
+            build_index = a
+        elif o == '--watch-index':
+            watch_index = a
+        elif o == '--index':
+            use_index = True
+        elif o == '--include':
+            include.append(a)
+        elif o == '--exclude':
+            exclude.append(a)
+        elif o == '--exclude-dir':
+            exclude_dir.append(a)
+        elif o == '--ignore-files':
+            use_ignore_files = True
+        elif o == '--color':
+            if a not in ('auto', 'always', 'never'):
+                print("option --color must be 'auto', 'always' or 'never'")
+                usage()
+                raise KeyboardInterrupt
+
+            color = a
+        elif o == '--serve':
+            serve = a
+        elif o == '--connect':
+            connect = a
+        elif o == '--cache-size':
+            try:
+                cache_size = int(a)
+
+            except ValueError:
+                print('option --cache-size requires a number of bytes')
+                usage()
+                raise KeyboardInterrupt
         elif o in ('-e'):
             do_regex_search = True
         elif o in ('-n'):
             display_line_numbers = True
+        elif o in ('-j'):
+            try:
+                workers = int(a)
+                assert workers >= 1
+
+            except (ValueError, AssertionError):
+                print('option -j requires a positive number of workers')
+                usage()
+                raise KeyboardInterrupt
+        elif o == '-l':
+            list_files = 'with_matches'
+        elif o == '-L':
+            list_files = 'without_match'
+        elif o == '-q':
+            is_quiet = True
+        elif o in ('-c', '--count'):
+            count_mode = 'lines'
+        elif o == '--count-matches':
+            count_mode = 'matches'
+        elif o == '-z':
+            decompress = True
+        elif o == '--search-archives':
+            search_archives = True
+        elif o == '--stats':
+            show_stats = True
+        elif o == '--show-patterns':
+            show_patterns = True
+        elif o == '--encoding':
+            try:
+                encoding = codecs.lookup(a).name
+                # Lines are split and matched as bytes
+                is_ascii_compatible = (u'\n'.encode(encoding) == b'\n' and
+                                       u'a'.encode(encoding) == b'a')
+
+            except LookupError:
+                print('unknown encoding: ' + a)
+                usage()
+                raise KeyboardInterrupt
+
+            if not is_ascii_compatible:
+                print('encoding is not ASCII compatible: ' + a)
+                usage()
+                raise KeyboardInterrupt
+        elif o == '--errors':
+            try:
+                codecs.lookup_error(a)
+                errors = a
+
+            except LookupError:
+                print('unknown error handler: ' + a)
+                usage()
+                raise KeyboardInterrupt
+        elif o == '-m':
+            try:
+                max_count = int(a)
+                assert max_count >= 0
+
+            except (ValueError, AssertionError):
+                print('option -m requires a number of lines')
+                usage()
+                raise KeyboardInterrupt
+        elif o in ('-A', '-B', '-C'):
+            try:
+                lines = int(a)
+                assert lines >= 0
+
+            except (ValueError, AssertionError):
+                print('option ' + o + ' requires a number of lines')
+                usage()
+                raise KeyboardInterrupt
+
+            if o == '-A':
+                after_context = lines
+            elif o == '-B':
+                before_context = lines
+            else:
+                context = lines
+        elif o == '-f':
+            try:
+                patterns = read_pattern_file(a)
+
+            except IOError as err:
+                print(str(err))
+                raise KeyboardInterrupt
+
+    # -A and -B take precedence over -C
+    if before_context is None:
+        before_context = context
+    if after_context is None:
+        after_context = context
     
     return  { args_key: args,
               search_recursively_key: search_recursively,
               full_paths_key: full_paths,
               do_regex_search_key: do_regex_search,
-              display_line_numbers_key: display_line_numbers
+              display_line_numbers_key: display_line_numbers,
+              workers_key: workers,
+              patterns_key: patterns,
+              build_index_key: build_index,
+              use_index_key: use_index,
+              watch_index_key: watch_index,
+              serve_key: serve,
+              connect_key: connect,
+              cache_size_key: cache_size,
+              include_key: include,
+              exclude_key: exclude,
+              exclude_dir_key: exclude_dir,
+              use_ignore_files_key: use_ignore_files,
+              color_key: color,
+              max_count_key: max_count,
+              list_files_key: list_files,
+              is_quiet_key: is_quiet,
+              count_mode_key: count_mode,
+              show_stats_key: show_stats,
+              encoding_key: encoding,
+              errors_key: errors,
+              decompress_key: decompress,
+              search_archives_key: search_archives,
+              before_context_key: before_context,
+              after_context_key: after_context,
+              show_patterns_key: show_patterns
             }
 
 
@@ -93,28 +364,95 @@ def main():
     full_paths           = parsed_values[full_paths_key]
     do_regex_search      = parsed_values[do_regex_search_key]
     display_line_numbers = parsed_values[display_line_numbers_key]
+    workers              = parsed_values[workers_key]
+    patterns             = parsed_values[patterns_key]
+    build_index          = parsed_values[build_index_key]
+    use_index            = parsed_values[use_index_key]
+    watch_index          = parsed_values[watch_index_key]
+    serve                = parsed_values[serve_key]
+    connect              = parsed_values[connect_key]
+    cache_size           = parsed_values[cache_size_key]
+    include              = parsed_values[include_key]
+    exclude              = parsed_values[exclude_key]
+    exclude_dir          = parsed_values[exclude_dir_key]
+    use_ignore_files     = parsed_values[use_ignore_files_key]
+    color                = parsed_values[color_key]
+    max_count            = parsed_values[max_count_key]
+    list_files           = parsed_values[list_files_key]
+    is_quiet             = parsed_values[is_quiet_key]
+    count_mode           = parsed_values[count_mode_key]
+    show_stats           = parsed_values[show_stats_key]
+    encoding             = parsed_values[encoding_key]
+    errors               = parsed_values[errors_key]
+    decompress           = parsed_values[decompress_key]
+    search_archives      = parsed_values[search_archives_key]
+    before_context       = parsed_values[before_context_key]
+    after_context        = parsed_values[after_context_key]
+    show_patterns        = parsed_values[show_patterns_key]
+
+    print_helper.set_color(color)
+
+    if build_index:
+        from . import index
+
+        index.build_index(build_index, search_recursively,
+                          index.default_index_path(build_index,
+                                                   search_recursively))
+        return
+
+    if watch_index:
+        from . import index
+        from . import watcher
+
+        try:
+            watcher.watch(watch_index, search_recursively,
+                          index.default_index_path(watch_index,
+                                                   search_recursively))
+
+        except KeyboardInterrupt:
+            pass
+
+        return
+
+    if serve:
+        from . import server
+
+        try:
+            server.serve(serve, cache_size)
+
+        except KeyboardInterrupt:
+            pass
+
+        except (IOError, OSError) as err:
+            sys.stderr.write('simple_grep: ' + str(err) + '\n')
+            sys.exit(2)
+
+        return
     
-    temp_dir      = tempfile.mkdtemp()
-    fd, temp_f    = tempfile.mkstemp(dir=temp_dir, suffix='.tmp', text=True)
     directory     = 1
     is_from_stdin = False
+    matched_files = []
     try:
 
+        # Like grep, '-' as FILE_TO_SEARCH is stdin. A given file or
+        # directory is searched whatever stdin is.
+        if args[1] == '-':
+            is_from_stdin = True
+
         # no stdin support for windows
-        if platform.system() != 'Windows':
-            # check for input - non-blocking
-            is_from_stdin = (sys.stdin in 
-                select.select( [sys.stdin], [], [], 0 ) [0])
-            
-        if is_from_stdin:
-            f = open(temp_f, 'w')
-            try:
-                f.write(sys.stdin.read())
-                directory = os.path.dirname(f.name)
+        elif not args[1] and os.name != 'nt':
+            import select
+
+            # A pipe is searched even if nothing has been written to it
+            # yet (tail -f), otherwise check for input - non-blocking
+            is_from_stdin = (
+                stat.S_ISFIFO(os.fstat(sys.stdin.fileno()).st_mode) or
+                sys.stdin in select.select([sys.stdin], [], [], 0)[0])
 
-            finally:
-                f.close()
-                assert type(directory) == str
+        if is_from_stdin:
+            # stdin is searched as it arrives, see file_helper.get_blocks
+            directory = empty_string
+            args[1] = empty_string
 
         else:
             f = args[1]
@@ -132,6 +470,54 @@ def main():
         search_term = args[0] if args[0] else empty_string
         specific_file = args[1]
 
+        index_path = None
+        if use_index and not is_from_stdin:
+            from . import index
+
+            index_path = index.default_index_path(directory,
+                                                  search_recursively)
+
+        # The exit status of -q and stats can't be sent back by the server
+        if connect and not is_from_stdin and not (is_quiet or show_stats):
+            from . import server
+            import socket
+
+            try:
+                server.query(
+                    connect,
+                    caller_dir=directory,
+                    search_term=search_term,
+                    specific_file=specific_file,
+                    is_recursive=search_recursively,
+                    is_abs_path=full_paths,
+                    is_regex_pattern=do_regex_search,
+                    is_search_line_by_line=display_line_numbers,
+                    workers=workers,
+                    patterns=patterns,
+                    index_path=index_path,
+                    max_count=max_count,
+                    list_files=list_files,
+                    count_mode=count_mode,
+                    encoding=encoding,
+                    errors=errors,
+                    decompress=decompress,
+                    search_archives=search_archives,
+                    before_context=before_context,
+                    after_context=after_context,
+                    show_patterns=show_patterns,
+                    include=include,
+                    exclude=exclude,
+                    exclude_dir=exclude_dir,
+                    use_ignore_files=use_ignore_files)
+                return
+
+            except socket.error:
+                # No server is running, search here instead
+                pass
+
+        if show_stats:
+            stats.enable()
+
         searcher = grep_.Searcher(
             caller_dir=directory,
             search_term=search_term,
@@ -140,17 +526,39 @@ def main():
             is_abs_path=full_paths,
             is_regex_pattern=do_regex_search,
             is_search_line_by_line=display_line_numbers,
-            is_from_stdin=is_from_stdin)
+            is_from_stdin=is_from_stdin,
+            workers=workers,
+            patterns=patterns,
+            index_path=index_path,
+            path_filter=path_filter.PathFilter(
+                include, exclude, exclude_dir, use_ignore_files),
+            max_count=max_count,
+            list_files=list_files,
+            is_quiet=is_quiet,
+            count_mode=count_mode,
+            encoding=encoding,
+            errors=errors,
+            decompress=decompress,
+            search_archives=search_archives,
+            before_context=before_context,
+            after_context=after_context,
+            show_patterns=show_patterns)
+
+        matched_files = searcher.run()
 
-        searcher.run()
+        if show_stats:
+            sys.stderr.write('\n'.join(stats.collected.format()) + '\n')
 
     except KeyboardInterrupt:
-        pass
+        # Lines found until then are still printed
+        print_helper.get_output().flush()
+
+    except re.error as err:
+        sys.stderr.write('simple_grep: invalid pattern: ' + str(err) + '\n')
+        sys.exit(2)
 
-    finally:
-        os.close(fd)
-        os.remove(temp_f)
-        os.removedirs(temp_dir)
+    if is_quiet:
+        sys.exit(0 if matched_files else 1)
 
 
 if __name__ == "__main__":
@@ -1,27 +1,203 @@
 """Supplies relevant files for grep.py."""
 
+import io
+import mmap
 import os
 import sys
 
+from . import stats
 
-def get_next_file(caller_dir, is_recursive):
-    """Generates next file to be searched."""
+try:
+    from os import scandir
+except ImportError:  # Py2
+    scandir = None
+
+# Number of directories listed at the same time
+walk_workers = 8
+
+
+# Encoding of the searched files, used for search terms and matched lines.
+encoding = 'utf-8'
+
+# Size of the windows used to count newlines in buffers without count().
+count_window_size = 1 << 20
+
+# Files are read in chunks of this size if they can't be memory mapped.
+chunk_size = 1 << 20
+
+# Name stdin is searched under. Only get_blocks' is_stdin reads stdin,
+# a file named '-' found while walking is a file.
+stdin_path = '-'
+
+# Magic bytes of compressed files and the modules decompressing them (-z).
+compressions = ((b'\x1f\x8b', 'gzip'), (b'BZh', 'bz2'),
+                (b'\xfd7zXZ\x00', 'lzma'))
+
+# Separates the path of an archive from the path of a member.
+archive_separator = '!/'
+
+# Larger files are read in chunks instead of being memory mapped.
+if sys.maxsize > 2**32:
+    mmap_max_size = 1 << 40
+else:
+    mmap_max_size = 1 << 28
+
+
+def get_next_file(caller_dir, is_recursive, path_filter=None):
+    """
+            Generates next file to be searched.
+            Subdirectories are listed concurrently ahead of time,
+            files are generated in the same order as os.walk finds them.
+            Directories the path filter rejects are not descended into.
+    """
 
     assert type(caller_dir) is str
     assert type(is_recursive) is bool
 
-    for root, dirs, files in os.walk(caller_dir):
-        for f in files:
+    if not caller_dir:
+        return
 
-            # Environment specific file paths.
-            file_path = os.path.normpath('{0}/{1}'.format(root, f))
+    ThreadPoolExecutor = None
+    if is_recursive:
+        try:
+            # Imported here, a non recursive search starts up faster
+            from concurrent.futures import ThreadPoolExecutor
+        except ImportError:  # Py2
+            pass
 
-            # Check if it is an actual file on disk.
-            if os.path.isfile(file_path):
-                yield file_path
+    root = os.path.normpath(caller_dir)
+    if not is_recursive or ThreadPoolExecutor is None:
+        stack = [(root, None)]
+        while stack:
+            files, dirs, skipped = list_dir(stack.pop(), path_filter)
+            if stats.collected is not None:
+                stats.collected.count('files_walked', len(files))
+                stats.collected.count('files_skipped', skipped)
 
-        if is_recursive is False:
-            break
+            for f in files:
+                yield f
+
+            if is_recursive:
+                stack.extend(reversed(dirs))
+        return
+
+    # Listings are only submitted for the next few directories on the stack,
+    # the walker can not get arbitrarily far ahead of the search
+    max_pending = 2 * walk_workers
+    executor = ThreadPoolExecutor(walk_workers)
+    stack = [[(root, None), None]]
+    pending = 0
+    try:
+        while stack:
+            directory, future = stack.pop()
+            if future is None:
+                future = executor.submit(list_dir, directory, path_filter)
+            else:
+                pending -= 1
+
+            files, dirs, skipped = future.result()
+            if stats.collected is not None:
+                stats.collected.count('files_walked', len(files))
+                stats.collected.count('files_skipped', skipped)
+
+            # The first subdirectory ends up on top, like os.walk
+            stack.extend([d, None] for d in reversed(dirs))
+            for entry in reversed(stack):
+                if pending >= max_pending:
+                    break
+                if entry[1] is None:
+                    entry[1] = executor.submit(list_dir, entry[0], path_filter)
+                    pending += 1
+
+            for f in files:
+                yield f
+
+    finally:
+        for _, future in stack:
+            if future is not None:
+                future.cancel()
+
+        executor.shutdown(wait=False)
+
+
+def list_dir(directory_and_rules, path_filter=None):
+    """
+            Lists the files and subdirectories of a directory.
+            Subdirectories are returned with the ignore rules they inherit,
+            along with the number of files the path filter skipped.
+    """
+
+    directory, rules = directory_and_rules
+
+    # Avoid './' in front of every path
+    prefix = '' if directory == os.curdir else os.path.join(directory, '')
+
+    entries = list(get_entries(directory))
+    if path_filter is not None:
+        rules = path_filter.get_rules(directory, prefix, rules,
+                                      [name for name, _, _ in entries])
+
+    files = []
+    dirs = []
+    skipped = 0
+    for name, is_dir, is_file in entries:
+        path = prefix + name
+        if is_dir:
+            if (path_filter is None or
+                    path_filter.is_dir_wanted(name, path, rules)):
+                dirs.append((path, rules))
+
+        elif is_file:
+            if (path_filter is None or
+                    path_filter.is_file_wanted(name, path, rules)):
+                files.append(path)
+            else:
+                skipped += 1
+
+    return files, dirs, skipped
+
+
+def get_entries(directory):
+    """
+            Generates (name, is directory, is file) of every entry.
+            The types scandir got from the directory listing are used,
+            no extra stat is needed for most entries.
+            Symbolic links to directories are neither.
+    """
+
+    if scandir is None:
+        try:
+            names = os.listdir(directory)
+
+        except OSError:
+            return
+
+        for name in names:
+            path = os.path.join(directory, name)
+            is_dir = os.path.isdir(path) and not os.path.islink(path)
+            yield name, is_dir, not is_dir and os.path.isfile(path)
+        return
+
+    try:
+        entries = scandir(directory)
+
+    except OSError:
+        return
+
+    try:
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+
+                # Check if it is an actual file on disk.
+                yield entry.name, is_dir, not is_dir and entry.is_file()
+
+            except OSError:
+                pass
+
+    finally:
+        if hasattr(entries, 'close'):
+            entries.close()
 
 
 def is_binary_file(file_path, block_size=512):
@@ -34,27 +210,343 @@ def is_binary_file(file_path, block_size=512):
 
     try:
         with open(file_path, 'rb') as f:
-            block = f.read(block_size)
+            return is_binary_block(f.read(block_size))
 
-            if b'\x00' in block:
-                return True  # Consider files containing null bytes binary
-            elif not block:
-                return False  # Consider an empty file a text file
+    except IOError as io_error:
+        return False
 
-            try:
-                block.decode('ascii')
-                return False
 
-            except UnicodeDecodeError:
-                return True
+def is_binary_block(block, sniff_encoding='ascii'):
+    """
+            Applies the checks of is_binary_file to an already read block.
+            Only null bytes count if sniff_encoding is None.
+    """
 
-    except IOError as io_error:
+    if b'\x00' in block:
+        return True  # Consider files containing null bytes binary
+    elif not block or sniff_encoding is None:
+        return False  # Consider an empty file a text file
+
+    try:
+        block.decode(sniff_encoding)
         return False
 
+    except UnicodeDecodeError:
+        return True
+
+
+def count_newlines(buf, start, end):
+    """Counts the newlines in buf[start:end] without copying all of it."""
+
+    if hasattr(buf, 'count'):
+        return buf.count(b'\n', start, end)
+
+    # mmap objects have no count(), count a window at a time instead
+    newlines = 0
+    for window_start in range(start, end, count_window_size):
+        window_end = min(window_start + count_window_size, end)
+        newlines += buf[window_start:window_end].count(b'\n')
+
+    return newlines
+
+
+def get_next_chunk(f, size=None):
+    """
+            Generates blocks of whole lines read from f in chunks of size.
+            The partial last line of a chunk is carried over to the next.
+    """
+
+    size = size or chunk_size
+    # Pieces of the partial line, joined once its end is read
+    carry = []
+    while True:
+        chunk = f.read(size)
+        if not chunk:
+            break
+
+        last_newline = chunk.rfind(b'\n')
+        if last_newline < 0:
+            carry.append(chunk)
+            continue
+
+        carry.append(chunk[:last_newline + 1])
+        yield b''.join(carry)
+        carry = [chunk[last_newline + 1:]]
+
+    block = b''.join(carry)
+    if block:
+        yield block
+
+
+class FileCache(object):
+    """Keeps the contents of files in memory up to max_size bytes."""
+
+    def __init__(self, max_size):
+        assert type(max_size) == int
+
+        self.max_size = max_size
+        self.size = 0
+        # {file path: ((mtime, size), contents)}
+        self.contents = {}
+
+    def get(self, file_path):
+        """Returns the contents of a file or None if they don't fit."""
+
+        stat = os.stat(file_path)
+        key = (stat.st_mtime, stat.st_size)
+
+        cached = self.contents.get(file_path)
+        if cached is not None:
+            if cached[0] == key:
+                return cached[1]
+
+            del self.contents[file_path]
+            self.size -= len(cached[1])
+
+        if not os.path.isfile(file_path) or (self.size + stat.st_size >
+                                             self.max_size):
+            return None
+
+        with open(file_path, 'rb') as f:
+            contents = f.read()
+
+        self.contents[file_path] = (key, contents)
+        self.size += len(contents)
+
+        return contents
+
+
+def get_stdin_blocks():
+    """
+            Generates blocks of whole lines of stdin as soon as they
+            arrive, only a chunk of the stream is in memory at a time.
+    """
+
+    # Unbuffered, a read returns what has arrived instead of waiting
+    # for a whole chunk
+    stdin = io.open(sys.stdin.fileno(), 'rb', buffering=0, closefd=False)
+    try:
+        for block in get_next_chunk(stdin):
+            yield block
+
+    finally:
+        stdin.close()
+
+
+def get_blocks(file_path, file_cache=None, decompress=False,
+               is_stdin=False):
+    """
+            Generates the blocks of whole lines of a file, which stays
+            open until the generator is exhausted or closed.
+            Cached files and memory mapped regular files are a single
+            block, everything else is read in chunks.
+            Compressed files are decompressed if decompress is set.
+            stdin is read instead of the file if is_stdin is set.
+    """
+
+    if is_stdin:
+        blocks = get_stdin_blocks()
+    elif decompress:
+        blocks = read_decompressed_blocks(file_path)
+    else:
+        blocks = read_blocks(file_path, file_cache)
+
+    if stats.collected is None:
+        return blocks
+
+    return get_counted_blocks(blocks, stats.collected)
+
+
+def get_counted_blocks(blocks, collected):
+    """
+            Generates blocks, counting their bytes.
+            Getting the first block is opening the file.
+    """
+
+    collected.count('files_searched')
+    start = stats.clock()
+    try:
+        for block in blocks:
+            if start is not None:
+                collected.add_time('opening', stats.clock() - start)
+                start = None
+
+            collected.count('bytes_read', len(block))
+            yield block
+
+    finally:
+        blocks.close()
+
+
+def get_decompressor(magic):
+    """Returns the module decompressing a file starting with magic or None."""
+
+    for compression_magic, module_name in compressions:
+        if magic.startswith(compression_magic):
+            try:
+                return __import__(module_name)
+
+            except ImportError:  # Py2 has no lzma
+                return None
+
+    return None
+
+
+def read_decompressed_blocks(file_path):
+    """
+            Generates the blocks of a compressed file, decompressed in
+            chunks while they are searched. Other files are read as usual.
+    """
+
+    with open(file_path, 'rb') as f:
+        decompressor = get_decompressor(f.read(6))
+        if decompressor is not None:
+            f.seek(0)
+            with decompressor.open(f) as decompressed:
+                for block in get_next_chunk(decompressed):
+                    yield block
+            return
+
+    blocks = read_blocks(file_path)
+    try:
+        for block in blocks:
+            yield block
+
+    finally:
+        blocks.close()
+
+
+def get_archive_members(file_path):
+    """
+            Returns a generator of (member path, blocks) of the files in
+            a zip or tar archive (compressed or not), None for other files.
+            Members are read one after another while they are searched,
+            nothing is extracted. Member paths look like
+            bundle.tar.gz!/logs/app.log
+    """
+
+    try:
+        with open(file_path, 'rb') as f:
+            head = f.read(512)
+
+    except IOError:
+        return None
+
+    if head.startswith(b'PK\x03\x04'):
+        import zipfile
+
+        try:
+            return iter_zip_members(file_path, zipfile.ZipFile(file_path))
+
+        except (zipfile.BadZipfile, IOError):
+            return None
+
+    # Plain tar files have 'ustar' in their header
+    if head[257:262] != b'ustar' and get_decompressor(head) is None:
+        return None
+
+    import tarfile
+
+    try:
+        # Streamed, members of compressed tars are decompressed in order
+        archive = tarfile.open(file_path, 'r|*')
+
+    except (tarfile.TarError, IOError, EOFError):
+        return None  # Compressed, but not a tar
+
+    return iter_tar_members(file_path, archive)
+
+
+def iter_zip_members(file_path, archive):
+    try:
+        for info in archive.infolist():
+            if info.filename.endswith('/'):
+                continue  # Directory
+
+            yield (file_path + archive_separator + info.filename,
+                   get_member_blocks(lambda info=info: archive.open(info)))
+
+    finally:
+        archive.close()
+
+
+def iter_tar_members(file_path, archive):
+    import tarfile
+    import zlib
+
+    try:
+        # The next member can only be read once the last one is done
+        for info in archive:
+            if not info.isfile():
+                continue
+
+            yield (file_path + archive_separator + info.name,
+                   get_member_blocks(
+                       lambda info=info: archive.extractfile(info)))
+
+    except (IOError, EOFError, zlib.error, tarfile.TarError):
+        pass  # Truncated or corrupt, the members before are searched
+
+    finally:
+        archive.close()
+
+
+def get_member_blocks(open_member):
+    """
+            Generates the blocks of an archive member opened by
+            open_member. Errors of corrupt archives are raised as IOError.
+    """
+
+    import tarfile
+    import zipfile
+    import zlib
+
+    try:
+        member = open_member()
+        try:
+            blocks = get_next_chunk(member)
+            if stats.collected is not None:
+                blocks = get_counted_blocks(blocks, stats.collected)
+
+            for block in blocks:
+                yield block
+
+        finally:
+            member.close()
+
+    except (EOFError, zlib.error, zipfile.BadZipfile, tarfile.TarError,
+            NotImplementedError, RuntimeError) as err:
+        # Unsupported compression or encrypted zip members included
+        raise IOError(str(err))
+
+
+def read_blocks(file_path, file_cache=None):
+    """Generates the blocks of get_blocks."""
+
+    if file_cache is not None:
+        contents = file_cache.get(file_path)
+        if contents is not None:
+            yield contents
+            return
+
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        buf = None
+        if 0 < size <= mmap_max_size:
+            try:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            except (EnvironmentError, OverflowError, ValueError):
+                pass
+
+        if buf is None:
+            # Empty or huge files and files which aren't regular files
+            for block in get_next_chunk(f):
+                yield block
+            return
 
-def with_read(file_path):
-    def wrapper(func):
-        with open(file_path, 'r') as f:
-            return func(f)
+        try:
+            yield buf
 
-    return wrapper
+        finally:
+            buf.close()
@@ -1,12 +1,89 @@
 """Search functionality for simple_grep."""
 
-import re
-import sre_constants
 import sys
+from collections import deque
+from itertools import islice
 
 from . import print_helper
 from . import file_helper
-from .file_helper import with_read
+from . import matchers
+from . import stats
+
+
+# Searcher used by the worker processes of a parallel search.
+_worker_searcher = None
+
+
+def _init_worker(searcher, is_collecting_stats=False):
+    """Stores the searcher in a freshly started worker process."""
+
+    global _worker_searcher
+    _worker_searcher = searcher
+
+    if is_collecting_stats:
+        stats.enable()
+    else:
+        stats.disable()
+
+
+def _search_in_worker(method_and_file_path):
+    """
+            Searches a single file (or the members of an archive) inside
+            a worker process. Stats are sent back with every file.
+    """
+
+    method, file_path = method_and_file_path
+    if stats.collected is not None:
+        stats.enable()
+
+    return (file_path,
+            list(_worker_searcher.search_sources(method, file_path)),
+            stats.collected)
+
+
+class Match(object):
+    """
+            A matched line of the file Searcher.paths[path_id].
+            offset is the byte offset of the line in the file, spans are
+            the (start, end) byte offsets of the matches in the line.
+            A matching binary file gives a single Match without a line,
+            a line printed as context of a match has no spans.
+            Searching for several patterns, pattern_ids holds the index
+            of the pattern found at every span.
+    """
+
+    __slots__ = ('path_id', 'line_num', 'offset', 'spans', 'line',
+                 'pattern_ids')
+
+    def __init__(self, path_id, line_num, offset, spans, line,
+                 pattern_ids=None):
+        self.path_id = path_id
+        self.line_num = line_num
+        self.offset = offset
+        self.spans = spans
+        self.line = line
+        self.pattern_ids = pattern_ids
+
+    @property
+    def is_binary(self):
+        return self.line is None
+
+    @property
+    def is_context(self):
+        return self.spans is None and self.line is not None
+
+    def __eq__(self, other):
+        return (isinstance(other, Match) and
+                all(getattr(self, slot) == getattr(other, slot)
+                    for slot in self.__slots__))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return (self.__class__.__name__ + '(' + ', '.join(
+            slot + '=' + repr(getattr(self, slot))
+            for slot in self.__slots__) + ')')
 
 
 class Searcher(object):
@@ -14,7 +91,12 @@ class Searcher(object):
 
     def __init__(self, caller_dir, search_term, specific_file, is_recursive,
                  is_abs_path, is_regex_pattern, is_search_line_by_line,
-                 is_from_stdin):
+                 is_from_stdin, workers=1, patterns=None, index_path=None,
+                 files=None, file_cache=None, out=None, path_filter=None,
+                 max_count=None, list_files=None, is_quiet=False,
+                 count_mode=None, encoding=None, errors='strict',
+                 decompress=False, search_archives=False, before_context=0,
+                 after_context=0, show_patterns=False):
 
         assert type(caller_dir) == str
         assert type(search_term) == str
@@ -24,6 +106,22 @@ class Searcher(object):
         assert type(is_regex_pattern) == bool
         assert type(is_search_line_by_line) == bool
         assert type(is_from_stdin) == bool
+        assert type(workers) == int and workers >= 1
+        assert patterns is None or type(patterns) == list
+        assert index_path is None or type(index_path) == str
+        assert files is None or type(files) == list
+        assert max_count is None or (type(max_count) == int and
+                                     max_count >= 0)
+        assert list_files in (None, 'with_matches', 'without_match')
+        assert type(is_quiet) == bool
+        assert count_mode in (None, 'lines', 'matches')
+        assert encoding is None or type(encoding) == str
+        assert type(errors) == str
+        assert type(decompress) == bool
+        assert type(search_archives) == bool
+        assert type(before_context) == int and before_context >= 0
+        assert type(after_context) == int and after_context >= 0
+        assert type(show_patterns) == bool
 
         self.caller_dir = caller_dir
         self.search_term = search_term
@@ -33,6 +131,52 @@ class Searcher(object):
         self.is_regex_pattern = is_regex_pattern
         self.is_search_line_by_line = is_search_line_by_line
         self.is_from_stdin = is_from_stdin
+        self.workers = workers
+        self.patterns = patterns
+        self.index_path = index_path
+        # Already walked files, the file cache and the output stream are
+        # used by the search server
+        self.files = files
+        self.file_cache = file_cache
+        self.out = out
+        self.path_filter = path_filter
+        # Lines matched in a file before it is closed, None for all
+        self.max_count = max_count
+        # Only print the names of the files with or without matches
+        self.list_files = list_files
+        # Only find out whether anything matches
+        self.is_quiet = is_quiet
+        # Only count the matching lines or the matches of every file
+        self.count_mode = count_mode
+        # Files are searched as bytes, matched lines are decoded with
+        # encoding and errors
+        self.encoding = encoding or file_helper.encoding
+        self.errors = errors
+        # A chosen encoding or error handler means files aren't expected
+        # to be ascii, only null bytes mark a binary file then
+        if encoding is None and errors == 'strict':
+            self.sniff_encoding = 'ascii'
+        else:
+            self.sniff_encoding = None
+        # Search the decompressed contents of compressed files
+        self.decompress = decompress
+        # Search the members of zip and tar archives like files
+        self.search_archives = search_archives
+        # Lines printed before and after every matched line, nothing but
+        # the matched lines is printed when listing or counting
+        if list_files or is_quiet or count_mode:
+            before_context = after_context = 0
+
+        self.before_context = before_context
+        self.after_context = after_context
+        # Print the patterns found in a line in front of it
+        self.show_patterns = show_patterns and patterns is not None
+        # Paths of the matched files, Match.path_id indexes them
+        self.paths = []
+
+        # Raises re.error for invalid patterns before any file is opened
+        self.matcher = matchers.make_matcher(search_term, is_regex_pattern,
+                                             patterns, self.encoding)
 
     def __repr__(self):
         return (
@@ -44,242 +188,707 @@ class Searcher(object):
              'is_abs_path={},'
              ' is_regex_pattern={}, '
              'is_search_line_by_line={}, '
-             'is_from_stdin={})'.format(
+             'is_from_stdin={}, '
+             'workers={}, '
+             'patterns={}, '
+             'index_path={}, '
+             'max_count={}, '
+             'list_files={}, '
+             'is_quiet={}, '
+             'count_mode={}, '
+             'encoding={}, '
+             'errors={}, '
+             'decompress={}, '
+             'search_archives={}, '
+             'before_context={}, '
+             'after_context={}, '
+             'show_patterns={})'.format(
                  self.caller_dir, self.search_term, self.specific_file,
                  self.is_recursive, self.is_abs_path, self.is_regex_pattern,
-                 self.is_search_line_by_line, self.is_from_stdin)))
+                 self.is_search_line_by_line, self.is_from_stdin,
+                 self.workers, self.patterns, self.index_path,
+                 self.max_count, self.list_files, self.is_quiet,
+                 self.count_mode, self.encoding, self.errors,
+                 self.decompress, self.search_archives, self.before_context,
+                 self.after_context, self.show_patterns)))
+
+    def __getstate__(self):
+        # Worker processes only search, these stay in this process
+        state = self.__dict__.copy()
+        state.update(files=None, file_cache=None, out=None, paths=[])
+        return state
 
     def run(self):
-        """Starts a search (using a file when specified)"""
+        """
+                Starts a search (using a file when specified)
+                Returns the matched files, or the printed files
+                without a match.
+        """
+
+        start = stats.clock()
+        all_matched = self.search_and_print()
+
+        if stats.collected is not None:
+            stats.collected.add_time('total', stats.clock() - start)
+            if self.list_files != 'without_match':
+                stats.collected.count('files_matched', len(all_matched))
+
+            stats.finish()
+
+        return all_matched
+
+    def search_and_print(self):
+        """Prints the results of the search as requested, see run."""
+
+        if self.count_mode and not (self.list_files or self.is_quiet):
+            all_matched = []
+            for file_path, count in self.search_files(self.get_files(),
+                                                      'count_file'):
+                if count is None:
+                    continue
+
+                if count:
+                    all_matched.append(file_path)
+
+                self.print_count(file_path, count)
+
+            (self.out or print_helper.get_output()).flush()
+
+            return all_matched
+
+        if self.list_files == 'without_match':
+            all_matched = []
+            for file_path, matches in self.search_files(self.get_files()):
+                if not matches:
+                    all_matched.append(file_path)
+                    self.print_file_name(file_path)
+
+            (self.out or print_helper.get_output()).flush()
+
+            return all_matched
 
         all_matched = []
-        if not self.specific_file:
-            for f in file_helper.get_next_file(self.caller_dir,
-                                               self.is_recursive):
-                matched_file = self.search_wrapper(f)
+        has_context = self.before_context or self.after_context
+        # (path id, line number) of the last printed line
+        last_printed = None
+        matches = self.iter_matches()
+        try:
+            for match in matches:
+                file_path = self.paths[match.path_id]
+                # The same file's matches come one after another
+                if not all_matched or all_matched[-1] != file_path:
+                    all_matched.append(file_path)
 
-                if matched_file:
-                    self.printing(matched_file)
-                    all_matched.extend(matched_file)
+                if self.is_quiet:
+                    # The answer is known, stop the whole search
+                    break
 
-        else:
-            matched_file = self.search_wrapper(self.specific_file)
+                if self.list_files:
+                    self.print_file_name(file_path)
+                    continue
+
+                if has_context and not match.is_binary:
+                    # Overlapping context is merged, groups of lines which
+                    # don't follow each other are separated
+                    if (last_printed is not None and last_printed !=
+                            (match.path_id, match.line_num - 1)):
+                        self.print_context_separator()
+
+                    last_printed = (match.path_id, match.line_num)
+
+                if match.is_context:
+                    self.print_context(file_path, match)
+                else:
+                    if self.show_patterns and not match.is_binary:
+                        match = self.with_patterns(match)
 
-            if matched_file:
-                self.printing(matched_file)
-                all_matched.extend(matched_file)
+                    self.printing({file_path: self.line_dict([match])})
+
+        finally:
+            matches.close()
+
+        (self.out or print_helper.get_output()).flush()
 
         return all_matched
 
+    def iter_matches(self):
+        """
+                Generates a Match for every match as soon as it is found.
+                The paths of matched files are added to self.paths.
+        """
+
+        files = self.get_files()
+
+        if self.workers == 1 or self.is_from_stdin:
+            for f in files:
+                for file_path, blocks in self.iter_sources(f):
+                    path_id = len(self.paths)
+                    for match in self.iter_file_matches(file_path, path_id,
+                                                        blocks):
+                        if path_id == len(self.paths):
+                            self.paths.append(file_path)
+
+                        yield match
+            return
+
+        # Worker processes send back the matches of a whole file
+        for file_path, matches in self.search_files(files):
+            if not matches:
+                continue
+
+            path_id = len(self.paths)
+            self.paths.append(file_path)
+            for match in matches:
+                match.path_id = path_id
+                yield match
+
+    def get_files(self):
+        """
+                Returns the files to search.
+                An up to date index skips files which can't match.
+        """
+
+        if self.is_from_stdin:
+            return [file_helper.stdin_path]
+
+        if self.specific_file:
+            return [self.specific_file]
+
+        files = self.files
+        if files is None:
+            files = file_helper.get_next_file(
+                self.caller_dir, self.is_recursive, self.path_filter)
+
+            if stats.collected is not None:
+                files = stats.collected.timed_iter('walking', files)
+
+        # Files the index skips are listed without a match or counted as 0,
+        # it knows nothing about the contents of compressed files
+        if (self.index_path is None or self.list_files == 'without_match' or
+                self.count_mode or self.decompress or self.search_archives):
+            return files
+
+        from . import index
+
+        loaded_index = index.load_index(self.index_path)
+        if loaded_index is None:
+            return files
+
+        return loaded_index.filter_files(
+            files, self.caller_dir, self.is_recursive,
+            self.matcher.literal_alternatives())
+
+    def search_files(self, files, method='find_matches'):
+        """
+                Generates (file path, result of method) of every file
+                (or archive member) in order. Files are fanned out to
+                a process pool if workers > 1.
+        """
+
+        # Only this process can read stdin
+        if self.workers == 1 or self.is_from_stdin:
+            for f in files:
+                for source in self.search_sources(method, f):
+                    yield source
+            return
+
+        # Imported here, starting up a single process search is faster
+        import multiprocessing
+
+        pool = multiprocessing.Pool(
+            self.workers,
+            initializer=_init_worker,
+            initargs=(self, stats.collected is not None))
+        try:
+            # imap keeps the order of the files and streams the results
+            for _, sources, worker_stats in pool.imap(
+                    _search_in_worker, ((method, f) for f in files),
+                    chunksize=16):
+                if worker_stats is not None and stats.collected is not None:
+                    stats.collected.merge(worker_stats)
+
+                for source in sources:
+                    yield source
+
+            pool.close()
+
+        except BaseException:
+            pool.terminate()
+            raise
+
+        finally:
+            pool.join()
+
+    def iter_sources(self, file_path):
+        """
+                Returns (path, blocks) of everything a file is searched as:
+                the members of an archive with search_archives, otherwise
+                the file itself with blocks None, it is opened when searched.
+        """
+
+        if self.search_archives and not self.is_from_stdin:
+            members = file_helper.get_archive_members(file_path)
+            if members is not None:
+                return members
+
+        return iter([(file_path, None)])
+
+    def search_sources(self, method, file_path):
+        """Generates (path, result of method) of every source of a file."""
+
+        search = getattr(self, method)
+        for source_path, blocks in self.iter_sources(file_path):
+            yield source_path, search(source_path, blocks)
+
+    def open_blocks(self, file_path, blocks=None):
+        """Returns the blocks of a file unless they are given already."""
+
+        if blocks is not None:
+            return blocks
+
+        return file_helper.get_blocks(file_path, self.file_cache,
+                                      self.decompress, self.is_from_stdin)
+
+    @stats.timed_stage('printing')
     def printing(self, matched_file):
         """Prints a matching file or line."""
 
         if self.is_abs_path:
             print_helper.generate_output_for_matched_files_full_path(
                 matched_file, self.search_term, self.is_from_stdin,
-                self.is_search_line_by_line)
+                self.is_search_line_by_line, self.out)
 
         else:
             print_helper.generate_output_for_matched_files_relative_path(
                 matched_file, self.search_term, self.is_from_stdin,
-                self.is_search_line_by_line)
-
-    def search_wrapper(self, file_path):
-        """Wraps search_f to accommodate for errors."""
-
-        matched_file = {}
+                self.is_search_line_by_line, self.out)
+
+    @stats.timed_stage('printing')
+    def print_file_name(self, file_path):
+        """Prints the name of a file for -l and -L."""
+
+        print_helper.generate_output_for_file_name(
+            file_path, self.is_abs_path, self.is_from_stdin, self.out)
+
+    @stats.timed_stage('printing')
+    def print_context(self, file_path, match):
+        """Prints a line before or after a matched line."""
+
+        print_helper.generate_output_for_context_line(
+            file_path, match.line_num, match.line, self.is_abs_path,
+            self.is_from_stdin, self.is_search_line_by_line, self.out)
+
+    @stats.timed_stage('printing')
+    def print_context_separator(self):
+        print_helper.generate_output_for_context_separator(self.out)
+
+    @stats.timed_stage('printing')
+    def print_count(self, file_path, count):
+        """Prints the count of a file for -c and --count-matches."""
+
+        print_helper.generate_output_for_count(
+            file_path, count, self.is_abs_path, self.is_from_stdin, self.out)
+
+    def with_patterns(self, match):
+        """Returns match with the patterns found in its line in front."""
+
+        patterns = []
+        for pattern_id in match.pattern_ids or []:
+            if (pattern_id is not None and
+                    self.patterns[pattern_id] not in patterns):
+                patterns.append(self.patterns[pattern_id])
+
+        return Match(match.path_id, match.line_num, match.offset,
+                     match.spans,
+                     print_helper.format_patterns(patterns, self.is_abs_path) +
+                     match.line, match.pattern_ids)
+
+    def find_matches(self, file_path, blocks=None):
+        """Returns the matches of a file as a list."""
+
+        return list(self.iter_file_matches(file_path, blocks=blocks))
+
+    def count_file(self, file_path, blocks=None):
+        """
+                Counts the matching lines (or the matches) of a file on
+                its blocks without building any lines.
+                Returns None if the file can't be read.
+        """
+
+        count_matches = (self.count_mode == 'matches' and
+                         not self.matcher.is_empty)
+        # Only literals can be counted without finding the lines
+        count_block = getattr(self.matcher, 'count', None)
+        if self.max_count is not None:
+            count_block = None
+
+        find = self.matcher.find
+        get_spans = self.matcher.spans
+        if stats.collected is not None:
+            find = stats.collected.timed('matching', find)
+            get_spans = stats.collected.timed('matching', get_spans)
+            if count_block is not None:
+                count_block = stats.collected.timed('matching', count_block)
+
+        lines = 0
+        matches = 0
+        blocks = self.open_blocks(file_path, blocks)
         try:
-            matched_file = self.search_f(file_path)
+            for block in blocks:
+                if count_matches and count_block is not None:
+                    matches += count_block(block)
+                    continue
 
-        except IOError:
-            pass
+                pos = 0
+                while pos < len(block) and lines != self.max_count:
+                    start = find(block, pos)
+                    if start < 0:
+                        break
 
-        except UnicodeDecodeError:
-            pass
+                    line_end = block.find(b'\n', start)
+                    if line_end < 0:
+                        line_end = len(block)
 
-        return matched_file
+                    pos = line_end + 1
+                    if count_matches:
+                        line_spans = get_spans(
+                            block, block.rfind(b'\n', 0, start) + 1,
+                            line_end)
+                        # Nothing matches inside the line itself
+                        if not line_spans:
+                            continue
 
-    def search_f(self, file_path):
-        """Starts a search."""
+                        matches += len(line_spans)
 
-        assert type(file_path) == str
-
-        matched_line_dict = {}
-        if self.is_search_line_by_line:
-            if self.is_regex_pattern:
-                try:
-                    matched_line_dict = self.search_line_by_line_for_regex_wrapper(
-                        file_path)
-
-                except sre_constants.error:
-                    pass
-            else:
-                matched_line_dict = self.search_line_by_line_for_term_wrapper(
-                    file_path)
+                    lines += 1
 
-        else:
-            if self.is_regex_pattern:
-                try:
-                    matched_line_dict = self.match_f_for_pattern_wrapper(
-                        file_path)
-                except sre_constants.error:
-                    pass
-            else:
-                matched_line_dict = self.match_f_for_str_wrapper(file_path)
+                if lines == self.max_count:
+                    break
 
-        if matched_line_dict:
-            return {file_path: matched_line_dict}
-        else:
+        except IOError:
             return None
 
-    def match_f_for_str_wrapper(self, file_path):
-        @with_read(file_path)
-        def match_f_for_str(f):
-            """Searches a file for the occurrence of a string."""
-
-            assert type(file_path) == str
+        finally:
+            blocks.close()
 
-            entire_file = f.read()
-            # Match literal str not regex pattern
-            regexp = re.compile(re.escape(self.search_term))
-            matches = regexp.findall(entire_file)
-            match = ""
-            try:
-                match = matches.pop()
+        return matches if count_matches else lines
 
-            except IndexError:
-                pass
+    def iter_file_matches(self, file_path, path_id=0, blocks=None):
+        """
+                Generates the matches of a file like iter_matches.
+                The file is closed as soon as enough lines matched.
+                blocks are read instead of the file if given.
+        """
 
-            matched = {}
-            previous = []
+        assert type(file_path) == str
 
-            if self.search_term == '':
-                return {'file': entire_file}
+        max_count = self.max_count
+        if self.list_files or self.is_quiet:
+            # One match answers whether the file matches
+            max_count = 1 if max_count is None else min(max_count, 1)
 
-            if match:
-                # Do not include matches if file is binary
-                if file_helper.is_binary_file(file_path):
-                    return {'file_matched': ''}
+        if max_count == 0:
+            if blocks is not None:
+                blocks.close()
+            return
 
-                for index, line in enumerate(entire_file.split()):
+        if self.is_search_line_by_line:
+            matches = self.iter_line_by_line(file_path, path_id, blocks)
+        else:
+            matches = self.iter_match_f(file_path, path_id, blocks)
 
-                    if match in line:
-                        previous.append(line)
-                        matched[index] = line
+        try:
+            count = 0
+            for match in matches:
+                yield match
 
-            return matched
+                if match.is_context:
+                    continue
 
-        return match_f_for_str
+                count += 1
+                if count == max_count:
+                    # Only the context of the last match is read on,
+                    # further matches in it are context, too
+                    for match in islice(matches, self.after_context):
+                        if not match.is_context:
+                            match = Match(match.path_id, match.line_num,
+                                          match.offset, None, match.line)
 
-    def match_f_for_pattern_wrapper(self, file_path):
-        @with_read(file_path)
-        def match_f_for_pattern(f):
-            """Searches a file using a pattern."""
+                        yield match
 
-            assert type(file_path) == str
+                    break
 
-            entire_file = f.read()
+        except IOError:
+            pass
 
-            regexp = re.compile(self.search_term)
-            matches = regexp.findall(entire_file)
-            match = ""
-            try:
-                match = matches.pop()
+        except UnicodeDecodeError:
+            pass
 
-            except IndexError:
-                pass
+        finally:
+            matches.close()
 
-            previous = []
-            matched = {}
+    def line_dict(self, matches):
+        """
+                Returns the matches of a file as {line number: line}, lines
+                are numbered from 0 unless searching line by line.
+                A binary file gives {print_helper.binary_match_key: ''}.
+        """
 
-            if self.search_term == '':
-                return {'file': entire_file}
+        first_line_num = 1 if self.is_search_line_by_line else 0
 
-            if match:
-                # Do not include matches if file is binary
-                if file_helper.is_binary_file(file_path):
-                    return {'file_matched': ''}
+        lines = {}
+        for match in matches:
+            if match.is_binary:
+                return {print_helper.binary_match_key: ''}
 
-                for index, line in enumerate(entire_file.split()):
+            if match.is_context:
+                continue
 
-                    if match in line:
-                        previous.append(line)
-                        matched[index] = line
+            lines[match.line_num - 1 + first_line_num] = match.line
 
-            return matched
+        return lines
 
-        return match_f_for_pattern
+    def match_f_wrapper(self, file_path):
+        """Searches a file for the search term."""
 
-    def search_line_by_line_for_term_wrapper(self, file_path):
-        @with_read(file_path)
-        def search_line_by_line_for_term(f):
-            """
-                    Searches a single file for occurrences of a string.
-                    Each line is searched separately.
-            """
+        matches = self.iter_match_f(file_path)
+        if self.matcher.is_empty:
+            # The whole file is the match
+            return dict(('file', match.line) for match in matches)
 
-            assert type(file_path) == str
+        return self.line_dict(matches)
 
-            matched_lines = {}
-            for line_num, line in enumerate(f):
+    def search_line_by_line_wrapper(self, file_path):
+        """
+                Searches a file for the search term.
+                Each line is searched separately.
+        """
 
-                if self.search_term == '':
-                    matched_lines[line_num + 1] = line.strip()
+        return self.line_dict(self.iter_line_by_line(file_path))
 
-                elif self.search_term in line:
-                    # Do not include matches if file is binary
-                    if file_helper.is_binary_file(file_path):
-                        return {'file_matched': ''}
+    # The matcher picks literal or regex search, these are kept for callers
+    match_f_for_str_wrapper = match_f_wrapper
+    match_f_for_pattern_wrapper = match_f_wrapper
+    search_line_by_line_for_term_wrapper = search_line_by_line_wrapper
+    search_line_by_line_for_regex_wrapper = search_line_by_line_wrapper
 
-                    split_str = line.split(self.search_term)
-                    matched_lines[line_num + 1] = (
-                        split_str[0] + self.search_term +
-                        split_str[1][:-len(split_str[1]) + len(
-                            split_str[0] + self.search_term)]).strip()
+    def iter_match_f(self, file_path, path_id=0, blocks=None):
+        """Generates the matched lines of a file."""
 
-            return matched_lines
+        blocks = self.open_blocks(file_path, blocks)
+        try:
+            if self.matcher.is_empty:
+                content = b''.join(block[:] for block in blocks)
+                yield Match(path_id, 1, 0, [],
+                            content.decode(self.encoding, self.errors))
+                return
 
-        return search_line_by_line_for_term
+            for match in self.iter_matched_lines(blocks, path_id):
+                yield match
 
-    def search_line_by_line_for_regex_wrapper(self, file_path):
-        @with_read(file_path)
-        def search_line_by_line_for_regex(f):
-            """
-                    Searches a file using a regex pattern.
-                    Each line is searched separately.
-            """
+        finally:
+            blocks.close()
 
-            assert type(file_path) == str
+    def iter_line_by_line(self, file_path, path_id=0, blocks=None):
+        """Generates the matched lines of a file, cut after the first match."""
 
-            regexp = re.compile(self.search_term)
-            matched_lines = {}
+        def format_line(line, spans):
+            if spans:
+                match = line[spans[0][0]:spans[0][1]]
+            else:
+                match = self.matcher.first_match(line)
 
-            for line_num, line in enumerate(f):
+            return self.trim_line(line, match)
 
-                if self.search_term == '':
-                    matched_lines[line_num + 1] = line.strip()
+        blocks = self.open_blocks(file_path, blocks)
+        try:
+            for match in self.iter_matched_lines(blocks, path_id, format_line):
+                yield match
+
+        finally:
+            blocks.close()
+
+    def iter_matched_lines(self, blocks, path_id=0, format_line=None):
+        """
+                Generates a Match for every line containing a match.
+                Blocks hold whole lines, only the matched lines are decoded.
+                The lines before and after a match are generated as context
+                without reading anything twice: the last before_context
+                lines of the previous block are kept in a ring buffer.
+        """
+
+        if format_line is None:
+            format_line = (lambda line, spans: line.decode(
+                self.encoding, self.errors).strip())
+
+        def format_context(line):
+            return line.decode(self.encoding, self.errors).strip()
+
+        find = self.matcher.find
+        get_spans = self.matcher.spans
+        if self.patterns is not None:
+            # Spans tell which pattern was found, too
+            get_spans = self.matcher.pattern_spans
+        is_binary_block = file_helper.is_binary_block
+
+        collected = stats.collected
+        if collected is not None:
+            find = collected.timed('matching', find)
+            get_spans = collected.timed('matching', get_spans)
+            format_line = collected.timed('decoding', format_line)
+            format_context = collected.timed('decoding', format_context)
+            is_binary_block = collected.timed('binary_sniffing',
+                                              is_binary_block)
+
+        before_context = self.before_context
+        after_context = self.after_context
+        # (line number, offset, line) of the last lines of earlier blocks
+        # which weren't printed
+        previous_lines = deque(maxlen=before_context)
+        # Lines after the last match still printed as its context
+        after_left = 0
+
+        has_matched = False
+        line_num = 1
+        block_offset = 0
+        head = None
+        for block in blocks:
+            if head is None:
+                head = block[:512]
+
+            counted_up_to = 0
+            # Everything before pos is printed
+            pos = 0
+            while pos < len(block):
+                if after_left:
+                    # Only this line is searched, reading stops after the
+                    # context of the last match if enough lines matched
+                    line_start = pos
+                    line_end = block.find(b'\n', line_start)
+                    if line_end < 0:
+                        line_end = len(block)
+
+                    line_spans = get_spans(block, line_start, line_end)
+
+                else:
+                    start = find(block, pos)
+                    if start < 0:
+                        break
+
+                    line_start = block.rfind(b'\n', 0, start) + 1
+                    line_end = block.find(b'\n', start)
+                    if line_end < 0:
+                        line_end = len(block)
+
+                    # Nothing matches inside the line itself
+                    line_spans = get_spans(block, line_start, line_end)
+                    if not line_spans:
+                        pos = line_end + 1
+                        continue
 
-                match = regexp.findall(line)
-                if match:
                     # Do not include matches if file is binary
-                    if file_helper.is_binary_file(file_path):
-                        return {'file_matched': ''}
-
-                    for row in match:
-                        if not row:
-                            del row
-
-                    try:
-                        split_str = line.split(match[0])
-                        matched_lines[line_num + 1] = (
-                            split_str[0] + match[0] +
-                            split_str[1][:-len(split_str[1]) + len(
-                                split_str[0] + match[0])]).strip()
-
-                    # Catch empty separator
-                    except ValueError:
-                        matched_lines[line_num + 1] = line.strip()
+                    if not has_matched and is_binary_block(
+                            head, self.sniff_encoding):
+                        if collected is not None:
+                            collected.count('files_binary')
+
+                        yield Match(path_id, None, None, None, None)
+                        return
+
+                    has_matched = True
+
+                line_num += file_helper.count_newlines(block, counted_up_to,
+                                                       line_start)
+                counted_up_to = line_start
+
+                if after_left and not line_spans:
+                    yield Match(path_id, line_num, block_offset + line_start,
+                                None,
+                                format_context(block[line_start:line_end]))
+
+                    previous_lines.clear()
+                    after_left -= 1
+                    pos = line_end + 1
+                    continue
+
+                if before_context:
+                    # The unprinted lines right before the match, walking
+                    # back through this block first
+                    before = []
+                    first = line_start
+                    while len(before) < before_context and first > pos:
+                        newline = block.rfind(b'\n', pos, first - 1)
+                        line_before = pos if newline < 0 else newline + 1
+                        before.append((line_num - len(before) - 1,
+                                       block_offset + line_before,
+                                       block[line_before:first - 1]))
+                        first = line_before
+
+                    if first == 0 and len(before) < before_context:
+                        missing = before_context - len(before)
+                        before.extend(reversed(
+                            list(previous_lines)[-missing:]))
+
+                    previous_lines.clear()
+
+                    for before_num, before_offset, line in reversed(before):
+                        yield Match(path_id, before_num, before_offset, None,
+                                    format_context(line))
+
+                spans = [(span[0] - line_start, span[1] - line_start)
+                         for span in line_spans]
+                pattern_ids = None
+                if self.patterns is not None:
+                    pattern_ids = [span[2] for span in line_spans]
+
+                # Keep the newline, trim_line relies on it
+                line = format_line(block[line_start:line_end + 1], spans)
+                if collected is not None:
+                    collected.count('lines_matched')
+
+                yield Match(path_id, line_num, block_offset + line_start,
+                            spans, line, pattern_ids)
+
+                after_left = after_context
+                # Continue after the matched line
+                pos = line_end + 1
+
+            line_num += file_helper.count_newlines(block, counted_up_to,
+                                                   len(block))
+
+            # Only the last block can end without a newline
+            if (before_context and pos < len(block) and
+                    block[len(block) - 1:] == b'\n'):
+                # Keep the last lines for a match at the start of the next
+                # block, they are copied out of the block
+                end = len(block)
+                last_lines = []
+                while len(last_lines) < before_context and end > pos:
+                    newline = block.rfind(b'\n', pos, end - 1)
+                    line_start = pos if newline < 0 else newline + 1
+                    last_lines.append((line_num - len(last_lines) - 1,
+                                       block_offset + line_start,
+                                       block[line_start:end - 1]))
+                    end = line_start
+
+                previous_lines.extend(reversed(last_lines))
+
+            block_offset += len(block)
+
+    def trim_line(self, line, match):
+        """Cuts a matched line short after the first match."""
+
+        # Cut the decoded text, bytes could be cut inside a character
+        line = line.decode(self.encoding, self.errors)
+        match = match.decode(self.encoding, self.errors)
+        try:
+            split_str = line.split(match)
+            line = (split_str[0] + match + split_str[1][:-len(split_str[1]) +
+                                                        len(split_str[0] +
+                                                            match)])
 
-            return matched_lines
+        # Catch empty separator
+        except ValueError:
+            pass
 
-        return search_line_by_line_for_regex
+        return line.strip()
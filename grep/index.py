@@ -0,0 +1,277 @@
+"""Persistent trigram index to narrow down the files grep.py searches."""
+
+import hashlib
+import json
+import os
+
+from . import file_helper
+
+index_version = 1
+
+
+def default_index_path(caller_dir, is_recursive):
+    """Returns the path of the index of a directory in the user's cache."""
+
+    assert type(caller_dir) == str
+    assert type(is_recursive) == bool
+
+    cache_dir = (os.environ.get('XDG_CACHE_HOME') or
+                 os.path.join(os.path.expanduser('~'), '.cache'))
+    key = hashlib.sha1('{0}:{1}'.format(
+        os.path.abspath(caller_dir), is_recursive).encode('utf-8'))
+
+    return os.path.join(cache_dir, 'simple_grep', key.hexdigest() + '.json')
+
+
+def get_trigrams(f):
+    """Collects the trigrams of a file read in chunks."""
+
+    trigrams = set()
+    carry = b''
+    while True:
+        chunk = f.read(file_helper.chunk_size)
+        if not chunk:
+            break
+
+        # Keep the trigrams spanning two chunks
+        chunk = carry + chunk
+        trigrams.update(chunk[i:i + 3] for i in range(len(chunk) - 2))
+        carry = chunk[-2:]
+
+    return trigrams
+
+
+def get_file_stats(caller_dir, files):
+    """Returns {path relative to caller_dir: [mtime, size]} of files."""
+
+    stats = {}
+    for f in files:
+        try:
+            stat = os.stat(f)
+
+        except OSError:
+            continue
+
+        stats[os.path.relpath(f, caller_dir)] = [stat.st_mtime, stat.st_size]
+
+    return stats
+
+
+class Index(object):
+    """Maps trigrams to the files of a directory containing them."""
+
+    def __init__(self, root, is_recursive, files, postings, unindexed):
+        assert type(root) == str
+        assert type(is_recursive) == bool
+
+        self.root = root
+        self.is_recursive = is_recursive
+        # [[relative path, mtime, size], ...], positions are the file ids.
+        # Removed files are None until the index is compacted.
+        self.files = files
+        # {trigram: [file id, ...]}
+        self.postings = postings
+        # Ids of files which couldn't be read, these are always searched
+        self.unindexed = unindexed
+
+        self.file_ids = dict((entry[0], file_id)
+                             for file_id, entry in enumerate(files)
+                             if entry is not None)
+
+    def to_json(self):
+        return {
+            'version': index_version,
+            'root': self.root,
+            'is_recursive': self.is_recursive,
+            'files': self.files,
+            # latin-1 maps every byte to a single code point
+            'postings': dict((trigram.decode('latin-1'), ids)
+                             for trigram, ids in self.postings.items()),
+            'unindexed': self.unindexed,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            str(data['root']), data['is_recursive'],
+            [[str(entry[0]), entry[1], entry[2]] if entry else None
+             for entry in data['files']],
+            dict((trigram.encode('latin-1'), ids)
+                 for trigram, ids in data['postings'].items()),
+            data['unindexed'])
+
+    def is_fresh(self, caller_dir, is_recursive, stats):
+        """Checks the index against the current stats of the walked files."""
+
+        if (os.path.abspath(caller_dir) != self.root or
+                is_recursive != self.is_recursive):
+            return False
+
+        # Files missing from stats may have been filtered out by the walk
+        return all(
+            path in self.file_ids and
+            self.files[self.file_ids[path]][1:] == stat
+            for path, stat in stats.items())
+
+    def candidates(self, alternatives):
+        """
+                Returns the relative paths of the files which can contain
+                a match or None if the literals don't narrow the search.
+                A match contains all literals of one of the alternatives.
+        """
+
+        if alternatives is None:
+            return None
+
+        file_ids = set(self.unindexed)
+        for literals in alternatives:
+            ids = None
+            for literal in literals:
+                for i in range(len(literal) - 2):
+                    posting = set(self.postings.get(literal[i:i + 3], ()))
+                    ids = posting if ids is None else ids & posting
+
+            if ids is None:
+                # Literals shorter than a trigram
+                return None
+
+            file_ids |= ids
+
+        return set(self.files[i][0] for i in file_ids
+                   if self.files[i] is not None)
+
+    def filter_files(self, files, caller_dir, is_recursive, alternatives):
+        """
+                Returns the files which can contain a match in walk order.
+                All files are returned if the index is stale.
+        """
+
+        files = list(files)
+        if not self.is_fresh(caller_dir, is_recursive,
+                             get_file_stats(caller_dir, files)):
+            return files
+
+        candidates = self.candidates(alternatives)
+        if candidates is None:
+            return files
+
+        return [f for f in files
+                if os.path.relpath(f, caller_dir) in candidates]
+
+    def update_file(self, caller_dir, path):
+        """
+                Indexes the file at path relative to caller_dir again,
+                it is removed from the index if it is gone.
+        """
+
+        self.remove_file(path)
+
+        full_path = os.path.join(caller_dir, path)
+        try:
+            stat = os.stat(full_path)
+
+        except OSError:
+            return
+
+        if not os.path.isfile(full_path):
+            return
+
+        file_id = len(self.files)
+        self.files.append([path, stat.st_mtime, stat.st_size])
+        self.file_ids[path] = file_id
+
+        try:
+            with open(full_path, 'rb') as f:
+                trigrams = get_trigrams(f)
+
+        except IOError:
+            self.unindexed.append(file_id)
+            return
+
+        for trigram in trigrams:
+            self.postings.setdefault(trigram, []).append(file_id)
+
+    def remove_file(self, path):
+        """Marks a file as removed, compact() drops it from the postings."""
+
+        file_id = self.file_ids.pop(path, None)
+        if file_id is not None:
+            self.files[file_id] = None
+
+    def remove_directory(self, path):
+        """Removes all files below the directory at path."""
+
+        prefix = os.path.join(path, '')
+        for file_path in [p for p in self.file_ids if p.startswith(prefix)]:
+            self.remove_file(file_path)
+
+    def needs_compaction(self):
+        return len(self.files) > 2 * len(self.file_ids)
+
+    def compact(self):
+        """Drops removed files and renumbers the file ids."""
+
+        new_ids = {}
+        files = []
+        for file_id, entry in enumerate(self.files):
+            if entry is not None:
+                new_ids[file_id] = len(files)
+                files.append(entry)
+
+        postings = {}
+        for trigram, ids in self.postings.items():
+            ids = [new_ids[i] for i in ids if i in new_ids]
+            if ids:
+                postings[trigram] = ids
+
+        self.files = files
+        self.postings = postings
+        self.unindexed = [new_ids[i] for i in self.unindexed if i in new_ids]
+        self.file_ids = dict(
+            (entry[0], file_id) for file_id, entry in enumerate(files))
+
+
+def build_index(caller_dir, is_recursive, index_path):
+    """Indexes the files of caller_dir and writes the index to index_path."""
+
+    assert type(caller_dir) == str
+    assert type(index_path) == str
+
+    index = Index(os.path.abspath(caller_dir), is_recursive, [], {}, [])
+    for f in file_helper.get_next_file(caller_dir, is_recursive):
+        index.update_file(caller_dir, os.path.relpath(f, caller_dir))
+
+    write_index(index, index_path)
+
+    return index
+
+
+def write_index(index, index_path):
+    """Replaces the index file atomically so readers never see a partial one."""
+
+    index_dir = os.path.dirname(os.path.abspath(index_path))
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+
+    temp_path = index_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(index.to_json(), f)
+
+    # Atomic on POSIX, os.replace doesn't exist on Py2
+    getattr(os, 'replace', os.rename)(temp_path, index_path)
+
+
+def load_index(index_path):
+    """Reads an index, returns None if it is missing or unreadable."""
+
+    try:
+        with open(index_path, 'r') as f:
+            data = json.load(f)
+
+    except (IOError, ValueError):
+        return None
+
+    if data.get('version') != index_version:
+        return None
+
+    return Index.from_json(data)
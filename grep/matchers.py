@@ -0,0 +1,764 @@
+"""Matchers built once per search and reused for every file of grep.py."""
+
+import re
+import sys
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Before Python 3.11
+    import sre_parse
+
+from . import file_helper
+
+_newline = ord('\n')
+
+# Up to this many terms a regex finds the first match of several terms
+# faster than the automaton, see AhoCorasickMatcher
+prefilter_max_terms = 10000
+
+_repeats = tuple(
+    getattr(sre_parse, op)
+    for op in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+    if hasattr(sre_parse, op))
+
+# Bytes outside of ASCII, lines holding them are searched as text
+_non_ascii = re.compile(b'[\x80-\xff]')
+
+# Decoding for text searches which encodes back to the same bytes
+_text_errors = 'surrogateescape' if sys.version_info[0] >= 3 else 'replace'
+
+# Categories containing the newline character
+_newline_categories = (sre_parse.CATEGORY_SPACE, sre_parse.CATEGORY_NOT_DIGIT,
+                       sre_parse.CATEGORY_NOT_WORD,
+                       sre_parse.CATEGORY_LINEBREAK)
+
+
+class LiteralMatcher(object):
+    """Finds a plain string."""
+
+    def __init__(self, term):
+        assert type(term) == bytes
+
+        self.term = term
+        self.is_empty = term == b''
+
+    def find(self, block, pos):
+        """Returns the start of the next match in block or -1."""
+
+        return block.find(self.term, pos)
+
+    def count(self, block):
+        """Counts the matches in block without finding their lines."""
+
+        if hasattr(block, 'count'):
+            return block.count(self.term)
+
+        # mmap objects have no count()
+        matches = 0
+        pos = block.find(self.term)
+        while pos >= 0:
+            matches += 1
+            pos = block.find(self.term, pos + len(self.term))
+
+        return matches
+
+    def spans(self, block, start, end):
+        """Returns (start, end) of the matches in block[start:end]."""
+
+        spans = []
+        pos = block.find(self.term, start, end)
+        while pos >= 0:
+            spans.append((pos, pos + len(self.term)))
+
+            # An empty term is found between all bytes, mmap.find
+            # clamps a start past the end
+            pos += len(self.term) or 1
+            if pos > end:
+                break
+
+            pos = block.find(self.term, pos, end)
+
+        return spans
+
+    def first_match(self, line):
+        """Returns the first matched bytes of line."""
+
+        return self.term
+
+    def literal_alternatives(self):
+        """Returns lists of literals, a match holds all of one of them."""
+
+        return [[self.term]]
+
+
+class RegexMatcher(object):
+    """
+            Finds a regex pattern, ^ and $ match at every line, $ before
+            \r\n line endings, too.
+            A literal every match has to contain is looked up first
+            so the regex only runs where it can match.
+            pattern is the alternation of alternatives if they are given.
+    """
+
+    def __init__(self, pattern, alternatives=None):
+        assert type(pattern) == bytes
+        assert alternatives is None or type(alternatives) == list
+
+        # Raises re.error for invalid patterns
+        self.regexp = re.compile(pattern, re.MULTILINE)
+        self.is_empty = pattern == b''
+        self.alternatives = [re.compile(alternative, re.MULTILINE)
+                             for alternative in alternatives or []]
+
+        self.literal, self.is_single_line = analyse_pattern(pattern)
+        self.matches_line_end = matches_line_end(pattern)
+
+    def line_end(self, block, start, end):
+        """
+                Returns the end of the line block[start:end] to match $ at,
+                before the \r of a \r\n line ending.
+        """
+
+        if (self.matches_line_end and end > start and
+                block[end - 1:end] == b'\r'):
+            return end - 1
+
+        return end
+
+    def find(self, block, pos):
+        """Returns the start of the next match in block or -1."""
+
+        if self.literal is None and self.is_single_line:
+            match = self.regexp.search(block, pos)
+
+            # $ matches before \r\n only in the line by line search below,
+            # it is needed if one of the lines up to the match has a \r
+            search_end = len(block)
+            if match is not None:
+                search_end = block.find(b'\n', match.start())
+                if search_end < 0:
+                    search_end = len(block)
+
+            if (not self.matches_line_end or
+                    block.find(b'\r', pos, search_end) < 0):
+                if match is None:
+                    return -1
+
+                # After the last newline of a block there is no line
+                if (match.start() == len(block) and
+                        block[len(block) - 1:] == b'\n'):
+                    return -1
+
+                return match.start()
+
+        # Only run the regex on single lines, on those containing the
+        # literal if there is one. A pattern which can match a newline
+        # must not match across lines.
+        while pos < len(block):
+            if self.literal is None:
+                line_start = pos
+                line_end = block.find(b'\n', pos)
+            else:
+                literal_start = block.find(self.literal, pos)
+                if literal_start < 0:
+                    return -1
+
+                line_start = max(pos,
+                                 block.rfind(b'\n', 0, literal_start) + 1)
+                line_end = block.find(b'\n', literal_start)
+
+            if line_end < 0:
+                line_end = len(block)
+
+            match = self.regexp.search(
+                block, line_start, self.line_end(block, line_start, line_end))
+            if match:
+                return match.start()
+
+            pos = line_end + 1
+
+        return -1
+
+    def spans(self, block, start, end):
+        """Returns (start, end) of the matches in block[start:end]."""
+
+        end = self.line_end(block, start, end)
+        return [m.span() for m in self.regexp.finditer(block, start, end)]
+
+    def pattern_spans(self, block, start, end):
+        """
+                Returns (start, end, index of the alternative) of the
+                matches in block[start:end].
+        """
+
+        end = self.line_end(block, start, end)
+        pattern_spans = []
+        for m in self.regexp.finditer(block, start, end):
+            # Like the alternation, the first alternative matching here
+            index = next((index for index, alternative in enumerate(
+                self.alternatives) if alternative.match(block, m.start(),
+                                                        end)), None)
+            pattern_spans.append(m.span() + (index, ))
+
+        return pattern_spans
+
+    def first_match(self, line):
+        """Returns the first matched bytes of line."""
+
+        match = self.regexp.search(line, 0, self.line_end(
+            line, 0, len(line.rstrip(b'\n'))))
+        return match.group(0) if match else b''
+
+    def literal_alternatives(self):
+        """Returns lists of literals, a match holds all of one of them."""
+
+        return None if self.literal is None else [[self.literal]]
+
+
+class AhoCorasickMatcher(object):
+    """
+            Finds any of several plain strings with an Aho-Corasick
+            automaton, scanning each block once for all of them.
+            Up to prefilter_max_terms terms a regex of them finds where
+            the first match starts, the automaton only scans matched
+            lines from there on.
+    """
+
+    def __init__(self, terms):
+        assert type(terms) == list
+
+        self.terms = terms
+        self.is_empty = False
+
+        # Trie of the terms, state 0 is the root
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for index, term in enumerate(terms):
+            assert type(term) == bytes
+
+            state = 0
+            for c in bytearray(term):
+                if c not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                    self.goto[state][c] = len(self.goto) - 1
+
+                state = self.goto[state][c]
+
+            self.out[state].append(index)
+
+        # The empty string is found at every position
+        self.matches_everywhere = bool(self.out[0])
+
+        # The terms as a regex shaped like the trie find where the first
+        # match starts much faster, the automaton only runs from there on
+        self.prefilter = None
+        if (terms and not self.matches_everywhere and
+                len(terms) <= prefilter_max_terms):
+            try:
+                self.prefilter = re.compile(_trie_pattern(terms))
+
+            except (re.error, RuntimeError, OverflowError):
+                pass
+
+        # Breadth first so the failure state of the parent is known
+        queue = list(self.goto[0].values())
+        while queue:
+            state = queue.pop(0)
+            for c, next_state in self.goto[state].items():
+                queue.append(next_state)
+
+                fail_state = self.fail[state]
+                while fail_state and c not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+
+                if state:
+                    self.fail[next_state] = self.goto[fail_state].get(c, 0)
+
+                self.out[next_state] = (self.out[next_state] +
+                                        self.out[self.fail[next_state]])
+
+    def scan(self, block, pos=0, end=None):
+        """Generates (start, term index) of every match in block[pos:end]."""
+
+        goto = self.goto
+        fail = self.fail
+        out = self.out
+        state = 0
+        for i in range(pos, len(block) if end is None else end):
+            c = block[i]
+            # Indexing a str gives a str on Py2
+            c = c if type(c) == int else ord(c)
+
+            while state and c not in goto[state]:
+                state = fail[state]
+
+            state = goto[state].get(c, 0)
+            for index in out[state]:
+                yield i + 1 - len(self.terms[index]), index
+
+    def scan_from_first(self, block, start, end):
+        """Like scan, starts the automaton where the first match starts."""
+
+        if self.prefilter is not None:
+            first = self.prefilter.search(block, start, end)
+            if first is None:
+                return iter(())
+
+            start = first.start()
+
+        return self.scan(block, start, end)
+
+    def find(self, block, pos):
+        """Returns the start of the first match in block or -1."""
+
+        if self.matches_everywhere:
+            return pos
+
+        if self.prefilter is not None:
+            match = self.prefilter.search(block, pos)
+            return -1 if match is None else match.start()
+
+        for start, _ in self.scan(block, pos):
+            return start
+
+        return -1
+
+    def spans(self, block, start, end):
+        """Returns (start, end) of the matches in block[start:end]."""
+
+        return [(match_start, match_start + len(self.terms[index]))
+                for match_start, index in self.scan_from_first(block, start,
+                                                               end)]
+
+    def pattern_spans(self, block, start, end):
+        """
+                Returns (start, end, index of the term) of the matches
+                in block[start:end].
+        """
+
+        return [(match_start, match_start + len(self.terms[index]), index)
+                for match_start, index in self.scan_from_first(block, start,
+                                                               end)]
+
+    def first_match(self, line):
+        """Returns the first matched bytes of line."""
+
+        for _, index in self.scan_from_first(line, 0, len(line)):
+            return self.terms[index]
+
+        return b''
+
+    def literal_alternatives(self):
+        """Returns lists of literals, a match holds all of one of them."""
+
+        return [[term] for term in self.terms]
+
+
+class TextRegexMatcher(RegexMatcher):
+    """
+            Finds a regex pattern whose meaning depends on characters
+            instead of bytes: non-ASCII characters, ignoring case, word
+            characters, '.{n}', ... Lines which aren't ASCII are decoded
+            and searched with the pattern as text, the bytes pattern only
+            runs where both agree.
+    """
+
+    def __init__(self, pattern, encoding, alternatives=None):
+        assert type(pattern) == str
+        assert alternatives is None or type(alternatives) == list
+
+        RegexMatcher.__init__(
+            self, pattern.encode(encoding),
+            None if alternatives is None else
+            [alternative.encode(encoding) for alternative in alternatives])
+
+        self.encoding = encoding
+        self.text_regexp = re.compile(pattern, re.MULTILINE)
+        self.text_alternatives = [re.compile(alternative, re.MULTILINE)
+                                  for alternative in alternatives or []]
+
+    def find(self, block, pos):
+        """Returns the start of the next match in block or -1."""
+
+        # Next match of the bytes pattern, None until it is searched for
+        start = None
+        while pos < len(block):
+            if start is None or 0 <= start < pos:
+                start = RegexMatcher.find(self, block, pos)
+
+            # Only up to the line of the match, the rest isn't needed yet
+            search_end = len(block)
+            if start >= 0:
+                search_end = block.find(b'\n', start)
+                if search_end < 0:
+                    search_end = len(block)
+
+            non_ascii = _non_ascii.search(block, pos, search_end)
+            if non_ascii is None:
+                return start
+
+            line_start = block.rfind(b'\n', 0, non_ascii.start()) + 1
+            if 0 <= start < line_start:
+                return start  # Found in ASCII lines
+
+            line_end = block.find(b'\n', non_ascii.start())
+            if line_end < 0:
+                line_end = len(block)
+
+            spans = self.text_spans(block, line_start, line_end)
+            if spans:
+                return spans[0][0]
+
+            pos = line_end + 1
+
+        return -1
+
+    def iter_text_matches(self, block, start, end):
+        """Generates (start, end, re match) of the text matches."""
+
+        end = self.line_end(block, start, end)
+        line = block[start:end].decode(self.encoding, _text_errors)
+        # Match positions are characters, the spans are bytes
+        for m in self.text_regexp.finditer(line):
+            match_start = start + len(
+                line[:m.start()].encode(self.encoding, _text_errors))
+            match_end = match_start + len(
+                m.group(0).encode(self.encoding, _text_errors))
+
+            yield match_start, match_end, m
+
+    def text_spans(self, block, start, end):
+        if (self.literal is not None and
+                block.find(self.literal, start, end) < 0):
+            return []
+
+        return [(match_start, match_end) for match_start, match_end, _ in
+                self.iter_text_matches(block, start, end)]
+
+    def spans(self, block, start, end):
+        """Returns (start, end) of the matches in block[start:end]."""
+
+        if _non_ascii.search(block, start, end) is None:
+            return RegexMatcher.spans(self, block, start, end)
+
+        return self.text_spans(block, start, end)
+
+    def pattern_spans(self, block, start, end):
+        """
+                Returns (start, end, index of the alternative) of the
+                matches in block[start:end].
+        """
+
+        if _non_ascii.search(block, start, end) is None:
+            return RegexMatcher.pattern_spans(self, block, start, end)
+
+        pattern_spans = []
+        for match_start, match_end, m in self.iter_text_matches(
+                block, start, end):
+            index = next((index for index, alternative in enumerate(
+                self.text_alternatives) if alternative.match(
+                    m.string, m.start())), None)
+            pattern_spans.append((match_start, match_end, index))
+
+        return pattern_spans
+
+    def first_match(self, line):
+        """Returns the first matched bytes of line."""
+
+        for match_start, match_end, _ in self.iter_text_matches(
+                line, 0, len(line.rstrip(b'\n'))):
+            return line[match_start:match_end]
+
+        return b''
+
+
+def _trie_pattern(terms):
+    """
+            Returns a regex matching any of terms with common prefixes
+            taken out, (?:ab(?:c|d)?|e) for ab, abc, abd and e.
+    """
+
+    trie = {}
+    for term in terms:
+        node = trie
+        for c in bytearray(term):
+            node = node.setdefault(c, {})
+
+        # None marks the end of a term
+        node[None] = {}
+
+    def build(node):
+        alternatives = [re.escape(bytes(bytearray([c]))) + build(node[c])
+                        for c in sorted(c for c in node if c is not None)]
+        if not alternatives:
+            return b''
+
+        if len(alternatives) == 1 and None not in node:
+            return alternatives[0]
+
+        pattern = b'(?:' + b'|'.join(alternatives) + b')'
+        return pattern + b'?' if None in node else pattern
+
+    return build(trie)
+
+
+def analyse_pattern(pattern):
+    """
+            Returns the longest literal all matches of pattern contain
+            (None if there is none) and whether a match fits on one line.
+    """
+
+    parsed = sre_parse.parse(pattern, re.MULTILINE)
+    flags = (parsed.state if hasattr(parsed, 'state') else parsed.pattern).flags
+
+    if flags & re.IGNORECASE:
+        literals = []
+    else:
+        literals = _required_literals(parsed)
+
+    literal = max(literals, key=len) if literals else None
+    is_single_line = not _can_match_newline(parsed, flags & re.DOTALL)
+
+    return literal, is_single_line
+
+
+def matches_line_end(pattern):
+    """Checks whether pattern holds a $ which matches at line ends."""
+
+    return _matches_line_end(sre_parse.parse(pattern, re.MULTILINE))
+
+
+def _matches_line_end(parsed):
+    for op, av in parsed:
+        if op == sre_parse.AT:
+            if av == sre_parse.AT_END:
+                return True
+            continue
+
+        # Groups, repeats, branches and lookarounds hold patterns
+        items = av[1] if op == sre_parse.BRANCH else av
+        if not isinstance(items, (tuple, list)):
+            items = (items, )
+
+        if any(isinstance(item, sre_parse.SubPattern) and
+               _matches_line_end(item) for item in items):
+            return True
+
+    return False
+
+
+def _required_literals(parsed):
+    """Collects the runs of literals every match of parsed contains."""
+
+    literals = []
+    run = bytearray()
+    for op, av in parsed:
+        if op == sre_parse.LITERAL:
+            run.append(av)
+            continue
+
+        if run:
+            literals.append(bytes(run))
+            run = bytearray()
+
+        if op == sre_parse.SUBPATTERN:
+            # (?i:...) changes the flags of a group
+            if len(av) < 4 or not av[1] & re.IGNORECASE:
+                literals.extend(_required_literals(av[-1]))
+
+        elif op in _repeats and av[0] >= 1:
+            literals.extend(_required_literals(av[2]))
+
+    if run:
+        literals.append(bytes(run))
+
+    return literals
+
+
+def _can_match_newline(parsed, dotall):
+    """Checks conservatively whether parsed could match a newline."""
+
+    for op, av in parsed:
+        if op == sre_parse.LITERAL:
+            if av == _newline:
+                return True
+
+        elif op == sre_parse.NOT_LITERAL:
+            if av != _newline:
+                return True
+
+        elif op == sre_parse.ANY:
+            if dotall:
+                return True
+
+        elif op == sre_parse.IN:
+            if _set_contains_newline(av):
+                return True
+
+        elif op == sre_parse.AT:
+            pass
+
+        elif op == sre_parse.SUBPATTERN:
+            sub_dotall = dotall or (len(av) == 4 and av[1] & re.DOTALL)
+            if _can_match_newline(av[-1], sub_dotall):
+                return True
+
+        elif op in _repeats:
+            if _can_match_newline(av[2], dotall):
+                return True
+
+        elif op == sre_parse.BRANCH:
+            if any(_can_match_newline(branch, dotall) for branch in av[1]):
+                return True
+
+        else:
+            # Group references, lookarounds, ...
+            return True
+
+    return False
+
+
+def needs_text_search(pattern):
+    """
+            Checks conservatively whether pattern could match non-ASCII
+            text differently as bytes than as text.
+    """
+
+    try:
+        pattern.encode('ascii')
+
+    except UnicodeError:
+        return True
+
+    parsed = sre_parse.parse(pattern, re.MULTILINE)
+    flags = (parsed.state if hasattr(parsed, 'state') else parsed.pattern).flags
+
+    return bool(flags & re.IGNORECASE) or _depends_on_characters(parsed)
+
+
+def _depends_on_characters(parsed):
+    for op, av in parsed:
+        if op == sre_parse.LITERAL:
+            pass
+
+        elif op == sre_parse.AT:
+            # \b and \B depend on which characters are letters
+            if av in (sre_parse.AT_BOUNDARY, sre_parse.AT_NON_BOUNDARY):
+                return True
+
+        elif op in (sre_parse.ANY, sre_parse.NOT_LITERAL):
+            # One byte is not one character
+            return True
+
+        elif op == sre_parse.IN:
+            if any(item_op in (sre_parse.NEGATE, sre_parse.CATEGORY)
+                   for item_op, _ in av):
+                return True
+
+        elif op == sre_parse.SUBPATTERN:
+            if len(av) == 4 and av[1] & re.IGNORECASE:
+                return True
+
+            if _depends_on_characters(av[-1]):
+                return True
+
+        elif op in _repeats:
+            # Any number of bytes is any number of characters
+            if (av[1] == sre_parse.MAXREPEAT and len(av[2]) == 1 and
+                    _matches_any_character(av[2][0])):
+                continue
+
+            if _depends_on_characters(av[2]):
+                return True
+
+        elif op == sre_parse.BRANCH:
+            if any(_depends_on_characters(branch) for branch in av[1]):
+                return True
+
+        else:
+            # Categories, group references, lookarounds, ...
+            return True
+
+    return False
+
+
+def _matches_any_character(item):
+    """Checks whether item is '.', [^...] or a negated literal."""
+
+    op, av = item
+    return (op in (sre_parse.ANY, sre_parse.NOT_LITERAL) or
+            (op == sre_parse.IN and av and av[0][0] == sre_parse.NEGATE and
+             all(item_op != sre_parse.CATEGORY for item_op, _ in av)))
+
+
+def _set_contains_newline(items):
+    """Checks whether a character set [...] contains the newline."""
+
+    for op, av in items:
+        if op == sre_parse.NEGATE:
+            return True
+        elif op == sre_parse.LITERAL and av == _newline:
+            return True
+        elif op == sre_parse.RANGE and av[0] <= _newline <= av[1]:
+            return True
+        elif op == sre_parse.CATEGORY and av in _newline_categories:
+            return True
+
+    return False
+
+
+# Matchers built before, a long running process reuses them
+_matcher_cache = {}
+_matcher_cache_size = 64
+
+
+def make_matcher(search_term, is_regex_pattern, patterns=None, encoding=None):
+    """
+            Picks the strategy for the search term, validating it up front.
+            Several patterns are searched for at once.
+            Terms are searched for as bytes in encoding.
+    """
+
+    assert type(search_term) == str
+    assert type(is_regex_pattern) == bool
+
+    encoding = encoding or file_helper.encoding
+
+    key = (search_term, is_regex_pattern,
+           None if patterns is None else tuple(patterns), encoding)
+    matcher = _matcher_cache.get(key)
+    if matcher is None:
+        if len(_matcher_cache) >= _matcher_cache_size:
+            _matcher_cache.clear()
+
+        matcher = _matcher_cache[key] = _build_matcher(
+            search_term, is_regex_pattern, patterns, encoding)
+
+    return matcher
+
+
+def _build_matcher(search_term, is_regex_pattern, patterns, encoding):
+    if patterns is not None:
+        assert type(patterns) == list
+
+        if is_regex_pattern:
+            pattern = '|'.join('(?:' + p + ')' for p in patterns)
+            if needs_text_search(pattern):
+                return TextRegexMatcher(pattern, encoding, patterns)
+
+            terms = [p.encode(encoding) for p in patterns]
+            return RegexMatcher(b'|'.join(b'(?:' + t + b')' for t in terms),
+                                terms)
+
+        return AhoCorasickMatcher([p.encode(encoding) for p in patterns])
+
+    if is_regex_pattern:
+        if needs_text_search(search_term):
+            return TextRegexMatcher(search_term, encoding)
+
+        return RegexMatcher(search_term.encode(encoding))
+
+    return LiteralMatcher(search_term.encode(encoding))
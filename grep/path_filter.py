@@ -0,0 +1,172 @@
+"""Decides which files and directories file_helper.get_next_file skips."""
+
+import fnmatch
+import os
+import re
+
+# Ignore files read in every directory, later files take precedence
+ignore_file_names = ('.gitignore', '.ignore')
+
+# Directories always skipped when ignore files are used
+ignored_dir_names = ('.git', )
+
+
+def compile_globs(globs):
+    """Compiles glob patterns matching names into one regex (None if empty)."""
+
+    if not globs:
+        return None
+
+    return re.compile('|'.join('(?:' + fnmatch.translate(glob) + ')'
+                               for glob in globs))
+
+
+def translate_ignore_pattern(pattern):
+    """Translates a .gitignore pattern into a regex for relative paths."""
+
+    # A slash anywhere but at the end anchors the pattern to its directory
+    is_anchored = '/' in pattern.rstrip('/')
+    pattern = pattern.strip('/')
+
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif pattern[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            regex += '[^/]'
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            char_class = pattern[i + 1:end].replace('\\', '\\\\')
+            if char_class.startswith('!'):
+                char_class = '^' + char_class[1:]
+            regex += '[' + char_class + ']'
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+
+    if not is_anchored:
+        regex = '(?:.*/)?' + regex
+
+    return re.compile(regex + r'\Z')
+
+
+class IgnoreRules(object):
+    """
+            The rules of the ignore files of one directory level,
+            linked to the rules of the directories above it.
+    """
+
+    def __init__(self, parent, prefix, lines):
+        self.parent = parent
+        # Paths below the directory start with prefix
+        self.prefix = prefix
+        # [(regex, is_negated, is_dir_only), ...]
+        self.rules = []
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+
+            is_negated = line.startswith('!')
+            if is_negated:
+                line = line[1:]
+
+            line = line.rstrip(' ')
+            self.rules.append((translate_ignore_pattern(line), is_negated,
+                               line.endswith('/')))
+
+    def is_ignored(self, path, is_dir):
+        """The last matching rule of the deepest directory decides."""
+
+        rules = self
+        while rules is not None:
+            relative_path = path[len(rules.prefix):].replace(os.sep, '/')
+            for regex, is_negated, is_dir_only in reversed(rules.rules):
+                if is_dir_only and not is_dir:
+                    continue
+
+                if regex.match(relative_path):
+                    return not is_negated
+
+            rules = rules.parent
+
+        return False
+
+
+class PathFilter(object):
+    """Include/exclude globs and ignore files applied while walking."""
+
+    def __init__(self,
+                 include=None,
+                 exclude=None,
+                 exclude_dir=None,
+                 use_ignore_files=False):
+        assert type(use_ignore_files) == bool
+
+        self.include = compile_globs(include)
+        self.exclude = compile_globs(exclude)
+        self.exclude_dir = compile_globs(exclude_dir)
+        self.use_ignore_files = use_ignore_files
+
+    def get_rules(self, directory, prefix, parent_rules, names):
+        """
+                Returns the rules for the entries of directory. Directories
+                without ignore files share the rules of their parent.
+        """
+
+        if not self.use_ignore_files:
+            return None
+
+        lines = []
+        for ignore_file_name in ignore_file_names:
+            if ignore_file_name not in names:
+                continue
+
+            try:
+                with open(os.path.join(directory, ignore_file_name)) as f:
+                    lines.extend(f.readlines())
+
+            except (IOError, UnicodeDecodeError):
+                pass
+
+        if not lines:
+            return parent_rules
+
+        return IgnoreRules(parent_rules, prefix, lines)
+
+    def is_dir_wanted(self, name, path, rules):
+        """Unwanted directories are not descended into."""
+
+        if self.exclude_dir is not None and self.exclude_dir.match(name):
+            return False
+
+        if self.use_ignore_files:
+            if name in ignored_dir_names:
+                return False
+
+            if rules is not None and rules.is_ignored(path, True):
+                return False
+
+        return True
+
+    def is_file_wanted(self, name, path, rules):
+        if self.include is not None and not self.include.match(name):
+            return False
+
+        if self.exclude is not None and self.exclude.match(name):
+            return False
+
+        if rules is not None and rules.is_ignored(path, False):
+            return False
+
+        return True
@@ -1,25 +1,141 @@
 """Print matched items for grep.py."""
 
+import errno
 import os
 import sys
 
-from . import file_helper
+# Key the search uses to mark a matching binary file.
+binary_match_key = 'file_matched'
+
+# Printed between groups of context lines which don't follow each other.
+context_separator = '--'
+
+# Output is colored unless set_color turns it off
+use_color = True
+
+# Bytes collected before the output is written when it isn't a terminal
+output_buffer_size = 1 << 16
+
+# Writer for sys.stdout, see get_output
+_stdout_writer = None
+
+
+class BufferedWriter(object):
+    """
+            Collects encoded output lines and writes them in large blocks.
+            Every line is written right away if line_buffered is set.
+            If exit_on_broken_pipe is set, the process exits quietly once
+            nobody reads the stream any more.
+    """
+
+    def __init__(self, stream, encoding='utf-8', line_buffered=False,
+                 exit_on_broken_pipe=False):
+        self.stream = stream
+        self.encoding = encoding
+        self.line_buffered = line_buffered
+        self.exit_on_broken_pipe = exit_on_broken_pipe
+        self.pending = []
+        self.pending_size = 0
+
+    def write_line(self, line):
+        data = (line + '\n').encode(self.encoding, 'replace')
+        self.pending.append(data)
+        self.pending_size += len(data)
+
+        if self.line_buffered or self.pending_size >= output_buffer_size:
+            self.flush()
+
+    def flush(self):
+        try:
+            if self.pending:
+                self.stream.write(b''.join(self.pending))
+                self.pending = []
+                self.pending_size = 0
+
+            self.stream.flush()
+
+        except (IOError, OSError) as err:
+            if not (self.exit_on_broken_pipe and err.errno == errno.EPIPE):
+                raise
+
+            # The reader is gone (| head), like grep stop without a
+            # traceback. What is left can't be flushed at exit either.
+            os.dup2(os.open(os.devnull, os.O_WRONLY), self.stream.fileno())
+            sys.exit(2)
+
+
+def get_output():
+    """Returns the writer for stdout, line buffered for terminals."""
+
+    global _stdout_writer
+
+    stdout = sys.stdout
+    # Py2 writes bytes to sys.stdout itself
+    stream = getattr(stdout, 'buffer', stdout)
+    if _stdout_writer is None or _stdout_writer.stream is not stream:
+        if _stdout_writer is not None:
+            _stdout_writer.flush()
+
+        _stdout_writer = BufferedWriter(
+            stream,
+            getattr(stdout, 'encoding', None) or 'utf-8',
+            line_buffered=is_terminal(stdout),
+            exit_on_broken_pipe=True)
+
+    return _stdout_writer
+
+
+def is_terminal(stream):
+    try:
+        return stream.isatty()
+
+    except (AttributeError, ValueError):
+        return False
+
+
+def set_color(when, stream=None):
+    """Colors output 'always', 'never' or if stream is a terminal ('auto')."""
+
+    global use_color
+
+    assert when in ('auto', 'always', 'never')
+
+    if when == 'auto':
+        use_color = is_terminal(stream or sys.stdout)
+    else:
+        use_color = when == 'always'
 
 
 def color_blue(term):
+    if not use_color:
+        return term
+
     return '\033[0;34m' + term + '\033[0m'
 
 
 def color_green(term):
+    if not use_color:
+        return term
+
     return '\033[0;32m' + term + '\033[0m'
 
 
 def color_purple(term):
+    if not use_color:
+        return term
+
     return '\033[0;35m' + term + '\033[0m'
 
 
+def is_binary_match(lines):
+    """Checks the search result instead of opening the file again."""
+
+    return binary_match_key in lines
+
+
 def generate_output_for_matched_files_full_path(
-        matched_files_and_lines, search_term, is_from_stdin, is_line_by_line):
+        matched_files_and_lines, search_term, is_from_stdin, is_line_by_line,
+        out=None):
     """Prints matching files using absolute paths."""
 
     assert type(matched_files_and_lines) == dict
@@ -30,7 +146,7 @@ def generate_output_for_matched_files_full_path(
     # Py2
     if sys.version_info[0] < 3:
         for f, lines in matched_files_and_lines.iteritems():
-            if file_helper.is_binary_file(f):
+            if is_binary_match(lines):
                 output.extend(['Binary file ' + f + ' matches'])
 
             else:
@@ -52,7 +168,7 @@ def generate_output_for_matched_files_full_path(
     # Py3
     else:
         for f, lines in matched_files_and_lines.items():
-            if file_helper.is_binary_file(f):
+            if is_binary_match(lines):
                 output.extend(['Binary file ' + f + ' matches'])
 
             else:
@@ -75,14 +191,16 @@ def generate_output_for_matched_files_full_path(
     output = [''.join(f.rsplit('\n', 1)) for f in output]
 
     # Color and print term
+    out = out or get_output()
     for line in color_matched_items(output, search_term):
-        print(line)
+        out.write_line(line)
 
     return output
 
 
 def generate_output_for_matched_files_relative_path(
-        matched_files_and_lines, search_term, is_from_stdin, is_line_by_line):
+        matched_files_and_lines, search_term, is_from_stdin, is_line_by_line,
+        out=None):
     """Prints matching files using relative paths."""
 
     assert type(matched_files_and_lines) == dict
@@ -93,7 +211,7 @@ def generate_output_for_matched_files_relative_path(
     # Py2
     if sys.version_info[0] < 3:
         for f, lines in matched_files_and_lines.iteritems():
-            if file_helper.is_binary_file(f):
+            if is_binary_match(lines):
                 output.extend(['Binary file ' + f + ' matches'])
 
             else:
@@ -116,7 +234,7 @@ def generate_output_for_matched_files_relative_path(
     # Py3
     else:
         for f, lines in matched_files_and_lines.items():
-            if file_helper.is_binary_file(f):
+            if is_binary_match(lines):
                 output.extend(['Binary file ' + f + ' matches'])
 
             else:
@@ -140,12 +258,94 @@ def generate_output_for_matched_files_relative_path(
     output = [''.join(f.rsplit('\n', 1)) for f in output]
 
     # Color and print term
+    out = out or get_output()
     for line in color_matched_items(output, search_term):
-        print(line)
+        out.write_line(line)
+
+    return output
+
+
+def format_file_name(file_path, is_abs_path, is_from_stdin):
+    if is_from_stdin:
+        return '(standard input)'
+    elif is_abs_path:
+        return color_purple(os.path.normpath(file_path))
+    else:
+        return color_purple(os.path.normpath(os.path.relpath(file_path)))
+
+
+def format_patterns(patterns, is_abs_path):
+    """Returns the patterns found in a line, printed in front of it."""
+
+    assert type(patterns) == list
+
+    separator = color_green(':') if is_abs_path else color_blue(':')
+    return color_green(','.join(patterns)) + separator
+
+
+def generate_output_for_file_name(file_path, is_abs_path, is_from_stdin,
+                                  out=None):
+    """Prints the name of a matching (or not matching) file."""
+
+    assert type(file_path) == str
+
+    name = format_file_name(file_path, is_abs_path, is_from_stdin)
+
+    out = out or get_output()
+    out.write_line(name)
+
+    return name
+
+
+def generate_output_for_count(file_path, count, is_abs_path, is_from_stdin,
+                              out=None):
+    """Prints the number of matches of a file."""
+
+    assert type(file_path) == str
+    assert type(count) == int
+
+    if is_from_stdin:
+        line = str(count)
+    else:
+        separator = color_green(':') if is_abs_path else color_blue(':')
+        line = (format_file_name(file_path, is_abs_path, is_from_stdin) +
+                separator + str(count))
+
+    out = out or get_output()
+    out.write_line(line)
+
+    return line
+
+
+def generate_output_for_context_line(file_path, line_num, line, is_abs_path,
+                                     is_from_stdin, is_line_by_line,
+                                     out=None):
+    """Prints a line around a match, separated by '-' instead of ':'."""
+
+    assert type(file_path) == str
+    assert type(line_num) == int
+
+    if is_from_stdin:
+        output = line
+    else:
+        separator = color_green('-') if is_abs_path else color_blue('-')
+        output = format_file_name(file_path, is_abs_path, is_from_stdin)
+        if is_line_by_line:
+            output += separator + color_green(str(line_num))
+
+        output += separator + line
+
+    out = out or get_output()
+    out.write_line(output)
 
     return output
 
 
+def generate_output_for_context_separator(out=None):
+    out = out or get_output()
+    out.write_line(context_separator)
+
+
 def color_term_in_string(func):
     """Colors the last occurrence of a term in a string."""
 
@@ -156,7 +356,7 @@ def color_term_in_string(func):
         bold_red = '\033[1;31m'
         no_color = '\033[0m'
 
-        if term:
+        if term and use_color:
             # Don't color output if output is 'Binary file x matches'
             if list_to_edit[0].startswith("Binary file"):
                 return list_to_edit
@@ -0,0 +1,174 @@
+"""Resident search server answering queries over a Unix domain socket."""
+
+import errno
+import json
+import os
+import re
+import socket
+import stat
+import sys
+import time
+
+try:
+    import socketserver
+except ImportError:  # Py2
+    import SocketServer as socketserver
+
+from . import file_helper
+from . import grep as grep_
+from . import path_filter
+from . import print_helper
+
+# Seconds a walked file list is reused before the directory is walked again
+walk_ttl = 5.0
+
+# Keys of a query, these are the arguments of Searcher
+query_keys = ('caller_dir', 'search_term', 'specific_file', 'is_recursive',
+              'is_abs_path', 'is_regex_pattern', 'is_search_line_by_line',
+              'workers', 'patterns', 'index_path', 'max_count', 'list_files',
+              'count_mode', 'encoding', 'errors', 'decompress',
+              'search_archives', 'before_context', 'after_context',
+              'show_patterns')
+
+# Keys of a query which are the arguments of PathFilter
+path_filter_keys = ('include', 'exclude', 'exclude_dir', 'use_ignore_files')
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """
+            Runs a single query and streams the output back after
+            a JSON line telling whether the query was valid.
+    """
+
+    def handle(self):
+        query = json.loads(self.rfile.readline().decode('utf-8'))
+        out = print_helper.BufferedWriter(
+            self.wfile, line_buffered=query.get('line_buffered', False))
+        print_helper.use_color = query.get('use_color', True)
+
+        # Relative paths are printed relative to the client
+        os.chdir(query['cwd'])
+
+        kwargs = dict((key, query[key]) for key in query_keys if key in query)
+        for key in ('caller_dir', 'search_term', 'specific_file'):
+            kwargs[key] = str(kwargs[key])
+
+        filter_kwargs = dict(
+            (key, query[key]) for key in path_filter_keys if key in query)
+        kwargs['path_filter'] = path_filter.PathFilter(**filter_kwargs)
+
+        if not kwargs['specific_file']:
+            kwargs['files'] = self.server.get_files(
+                kwargs['caller_dir'], kwargs['is_recursive'],
+                kwargs['path_filter'], json.dumps(filter_kwargs,
+                                                  sort_keys=True))
+
+        try:
+            searcher = grep_.Searcher(
+                is_from_stdin=False,
+                file_cache=self.server.file_cache,
+                out=out,
+                **kwargs)
+
+        except re.error as err:
+            self.write_status(str(err))
+            return
+
+        self.write_status(None)
+        searcher.run()
+
+    def write_status(self, error):
+        self.wfile.write(json.dumps({'error': error}).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+
+class SearchServer(socketserver.UnixStreamServer):
+    """Keeps walked directories, matchers and file contents between queries."""
+
+    def __init__(self, socket_path, cache_size=0):
+        assert type(socket_path) == str
+        assert type(cache_size) == int
+
+        socketserver.UnixStreamServer.__init__(self, socket_path,
+                                               RequestHandler)
+        # {(directory, is_recursive, filter): (time of the walk, files)}
+        self.file_lists = {}
+        # Contents of up to cache_size bytes of files, 0 disables the cache
+        self.file_cache = (file_helper.FileCache(cache_size)
+                           if cache_size else None)
+
+    def get_files(self, caller_dir, is_recursive, path_filter, filter_key):
+        """Returns the files of a directory, walking it at most every walk_ttl."""
+
+        key = (os.path.abspath(caller_dir), is_recursive, filter_key)
+        walked = self.file_lists.get(key)
+        if walked is None or time.time() - walked[0] > walk_ttl:
+            walked = (time.time(),
+                      list(file_helper.get_next_file(
+                          caller_dir, is_recursive, path_filter)))
+            self.file_lists[key] = walked
+
+        return walked[1]
+
+
+def serve(socket_path, cache_size=0):
+    """Answers queries on socket_path until interrupted."""
+
+    if os.path.lexists(socket_path):
+        # Only the socket of an earlier server is replaced, never a file
+        if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+            raise OSError(errno.EEXIST, 'Not a socket, not replacing it',
+                          socket_path)
+
+        os.remove(socket_path)
+
+    server = SearchServer(socket_path, cache_size)
+    try:
+        server.serve_forever()
+
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+def query(socket_path, out=None, **kwargs):
+    """
+            Sends a query to the server and copies its output to out.
+            Raises socket.error if there is no server and re.error if
+            the server found the pattern invalid.
+    """
+
+    kwargs['cwd'] = os.getcwd()
+    kwargs['use_color'] = print_helper.use_color
+    kwargs['line_buffered'] = print_helper.is_terminal(sys.stdout)
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        client.sendall(json.dumps(kwargs).encode('utf-8') + b'\n')
+
+        out = out or getattr(sys.stdout, 'buffer', sys.stdout)
+        # The output follows the status line
+        status = b''
+        while True:
+            data = client.recv(1 << 16)
+            if not data:
+                break
+
+            if status is not None:
+                status += data
+                if b'\n' not in status:
+                    continue
+
+                status, data = status.split(b'\n', 1)
+                error = json.loads(status.decode('utf-8'))['error']
+                if error is not None:
+                    raise re.error(error)
+
+                status = None
+
+            out.write(data)
+            out.flush()
+
+    finally:
+        client.close()
@@ -0,0 +1,147 @@
+"""Counters and timers of the stages of a search, see --stats."""
+
+import time
+
+# Stats of the running search, None while they aren't collected.
+# Every call site checks this first, so disabled stats cost a comparison.
+collected = None
+
+# Functions called with the collected Stats when a search finished
+_hooks = []
+
+# High resolution clock, Py2 only has time.time
+clock = getattr(time, 'perf_counter', time.time)
+
+counter_names = ('files_walked', 'files_skipped', 'files_searched',
+                 'files_binary', 'files_matched', 'lines_matched',
+                 'bytes_read')
+
+stages = ('walking', 'opening', 'binary_sniffing', 'matching', 'decoding',
+          'printing', 'total')
+
+
+class Stats(object):
+    """Counters and the seconds spent in every stage of a search."""
+
+    def __init__(self):
+        self.counters = {}
+        self.seconds = {}
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, stage, seconds):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def timed(self, stage, func):
+        """Wraps func to add the time of every call to stage."""
+
+        def timed_func(*args):
+            start = clock()
+            try:
+                return func(*args)
+
+            finally:
+                self.add_time(stage, clock() - start)
+
+        return timed_func
+
+    def timed_iter(self, stage, iterable):
+        """Generates the items of iterable, the time to get them is stage's."""
+
+        iterator = iter(iterable)
+        while True:
+            start = clock()
+            try:
+                item = next(iterator)
+
+            except StopIteration:
+                return
+
+            finally:
+                self.add_time(stage, clock() - start)
+
+            yield item
+
+    def merge(self, other):
+        """Adds the stats of a worker process."""
+
+        for name, n in other.counters.items():
+            self.count(name, n)
+
+        for stage, seconds in other.seconds.items():
+            self.add_time(stage, seconds)
+
+    def to_dict(self):
+        return {'counters': dict(self.counters), 'seconds': dict(self.seconds)}
+
+    def format(self):
+        """Returns the lines of the --stats summary."""
+
+        lines = ['simple_grep stats:']
+        for name in counter_names:
+            lines.append('  {:<18}{:>12}'.format(
+                name.replace('_', ' '), self.counters.get(name, 0)))
+
+        # Worker processes add up their seconds
+        for stage in stages:
+            lines.append('  {:<18}{:>11.3f}s'.format(
+                stage.replace('_', ' '), self.seconds.get(stage, 0.0)))
+
+        return lines
+
+
+def timed_stage(stage):
+    """Decorates a function to add the time of its calls to stage."""
+
+    def decorator(func):
+
+        def timed_func(*args, **kwargs):
+            if collected is None:
+                return func(*args, **kwargs)
+
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+
+            finally:
+                if collected is not None:
+                    collected.add_time(stage, clock() - start)
+
+        return timed_func
+
+    return decorator
+
+
+def enable():
+    """Starts collecting stats, returns the new Stats."""
+
+    global collected
+    collected = Stats()
+
+    return collected
+
+
+def disable():
+    global collected
+    collected = None
+
+
+def add_hook(func):
+    """func is called with the Stats of every search when it finished."""
+
+    _hooks.append(func)
+
+
+def remove_hook(func):
+    _hooks.remove(func)
+
+
+def finish():
+    """Hands the collected stats to the hooks."""
+
+    if collected is None:
+        return
+
+    for hook in list(_hooks):
+        hook(collected)
@@ -0,0 +1,217 @@
+"""Keeps the search index of index.py up to date while files change."""
+
+import os
+import select
+import struct
+import sys
+import time
+
+from . import file_helper
+from . import index
+
+# Seconds without further changes before a batch is written to disk
+batch_delay = 0.5
+
+# Seconds a batch is collected at most, files which keep changing (logs
+# being appended to) would delay writing the index forever otherwise
+batch_max_age = 5.0
+
+
+class PollingWatcher(object):
+    """Finds changed files by comparing their stats between polls."""
+
+    def __init__(self, caller_dir, is_recursive):
+        assert type(caller_dir) == str
+        assert type(is_recursive) == bool
+
+        self.caller_dir = caller_dir
+        self.is_recursive = is_recursive
+        self.stats = self.get_stats()
+
+    def get_stats(self):
+        return index.get_file_stats(
+            self.caller_dir,
+            file_helper.get_next_file(self.caller_dir, self.is_recursive))
+
+    def wait_for_changes(self, timeout):
+        """Returns the relative paths of the files changed since the last call."""
+
+        time.sleep(timeout)
+
+        stats = self.get_stats()
+        changed = set(path for path in set(stats) | set(self.stats)
+                      if stats.get(path) != self.stats.get(path))
+        self.stats = stats
+
+        return changed, set()
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """Gets changed files from the Linux kernel via inotify."""
+
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_ISDIR = 0x40000000
+
+    mask = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+            IN_MOVED_TO | IN_CREATE | IN_DELETE)
+
+    event_header = struct.Struct('iIII')
+
+    def __init__(self, caller_dir, is_recursive):
+        assert type(caller_dir) == str
+        assert type(is_recursive) == bool
+
+        import ctypes
+        import ctypes.util
+
+        self.libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.caller_dir = caller_dir
+        self.is_recursive = is_recursive
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        # {watch descriptor: directory relative to caller_dir}
+        self.directories = {}
+        self.add_watches(os.curdir)
+
+    def add_watches(self, directory):
+        """Watches directory (and its subdirectories if recursive)."""
+
+        for root, dirs, _ in os.walk(os.path.join(self.caller_dir, directory)):
+            wd = self.libc.inotify_add_watch(
+                self.fd, root.encode(sys.getfilesystemencoding()), self.mask)
+            if wd >= 0:
+                self.directories[wd] = os.path.normpath(
+                    os.path.relpath(root, self.caller_dir))
+
+            if not self.is_recursive:
+                break
+
+    def wait_for_changes(self, timeout):
+        """
+                Returns the relative paths of the changed files and of the
+                removed directories, waiting up to timeout seconds.
+        """
+
+        changed = set()
+        removed_directories = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed, removed_directories
+
+        data = os.read(self.fd, 1 << 16)
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, name_len = self.event_header.unpack_from(data, pos)
+            pos += self.event_header.size
+            name = data[pos:pos + name_len].rstrip(b'\x00').decode(
+                sys.getfilesystemencoding())
+            pos += name_len
+
+            if mask & self.IN_Q_OVERFLOW:
+                # Events were lost, check every file
+                changed.update(index.get_file_stats(
+                    self.caller_dir,
+                    file_helper.get_next_file(self.caller_dir,
+                                              self.is_recursive)))
+                continue
+
+            directory = self.directories.get(wd)
+            if directory is None or not name:
+                continue
+
+            path = os.path.normpath(os.path.join(directory, name))
+            if not mask & self.IN_ISDIR:
+                changed.add(path)
+
+            elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                removed_directories.add(path)
+
+            elif mask & (self.IN_CREATE | self.IN_MOVED_TO) and self.is_recursive:
+                # Files created before the watch was added send no events
+                self.add_watches(path)
+                for f in file_helper.get_next_file(
+                        os.path.join(self.caller_dir, path), True):
+                    changed.add(os.path.relpath(f, self.caller_dir))
+
+        return changed, removed_directories
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(caller_dir, is_recursive):
+    """Uses inotify on Linux and falls back to polling."""
+
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(caller_dir, is_recursive)
+
+        except (OSError, AttributeError):
+            pass
+
+    return PollingWatcher(caller_dir, is_recursive)
+
+
+def apply_changes(loaded_index, caller_dir, changed, removed_directories):
+    """Updates the index for a batch of changes."""
+
+    for directory in removed_directories:
+        loaded_index.remove_directory(directory)
+
+    for path in changed:
+        loaded_index.update_file(caller_dir, path)
+
+    if loaded_index.needs_compaction():
+        loaded_index.compact()
+
+
+def watch(caller_dir, is_recursive, index_path, interval=1.0, watcher=None):
+    """Keeps the index of caller_dir up to date until interrupted."""
+
+    assert type(caller_dir) == str
+    assert type(is_recursive) == bool
+
+    watcher = watcher or make_watcher(caller_dir, is_recursive)
+    try:
+        loaded_index = index.load_index(index_path)
+        if loaded_index is None or not loaded_index.is_fresh(
+                caller_dir, is_recursive, index.get_file_stats(
+                    caller_dir,
+                    file_helper.get_next_file(caller_dir, is_recursive))):
+            loaded_index = index.build_index(caller_dir, is_recursive,
+                                             index_path)
+
+        while True:
+            changed, removed_directories = watcher.wait_for_changes(interval)
+            if not changed and not removed_directories:
+                continue
+
+            # Collect changes until things calm down to write once
+            batch_start = time.time()
+            while time.time() - batch_start < batch_max_age:
+                more_changed, more_removed = watcher.wait_for_changes(
+                    batch_delay)
+                if not more_changed and not more_removed:
+                    break
+
+                changed |= more_changed
+                removed_directories |= more_removed
+
+            apply_changes(loaded_index, caller_dir, changed,
+                          removed_directories)
+            index.write_index(loaded_index, index_path)
+
+    finally:
+        watcher.close()
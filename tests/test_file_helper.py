@@ -1,4 +1,7 @@
+import mmap
 import os
+import sys
+import time
 
 from grep import file_helper
 from tests.helper_for_tests import with_f_bwrite, with_f_write, temp_path
@@ -59,3 +62,154 @@ def test_null_bytes_file_is_binary(with_f_bwrite):
     actual = file_helper.is_binary_file(name)
 
     assert actual == test_result
+
+
+def test_count_newlines_in_windows(with_f_write):
+    with_f_write.write('a\nb\nc\n' * 10)
+    with_f_write.flush()
+
+    window_size = file_helper.count_window_size
+    file_helper.count_window_size = 4
+    try:
+        with open(with_f_write.name, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            actual = file_helper.count_newlines(buf, 2, len(buf))
+            buf.close()
+
+    finally:
+        file_helper.count_window_size = window_size
+
+    assert actual == 29
+
+
+def test_get_next_chunk_carries_over_partial_lines(with_f_write):
+    with_f_write.write('first line\nsecond\nthird line\nlast')
+    with_f_write.flush()
+
+    with open(with_f_write.name, 'rb') as f:
+        actual = list(file_helper.get_next_chunk(f, size=8))
+
+    assert actual == [b'first line\n', b'second\n', b'third line\n', b'last']
+
+
+def test_get_next_file_walks_like_os_walk(tmpdir):
+    for directory in ('a', 'a/b', 'a/b/c', 'd', 'e'):
+        tmpdir.join(*directory.split('/')).ensure(dir=True)
+        for name in ('1.txt', '2.txt'):
+            tmpdir.join(*(directory.split('/') + [name])).write(name)
+
+    caller_dir = str(tmpdir) + os.sep
+
+    for is_recursive in (True, False):
+        actual = list(file_helper.get_next_file(caller_dir, is_recursive))
+        expected = []
+        for root, dirs, files in os.walk(caller_dir):
+            expected.extend(os.path.join(os.path.normpath(root), f)
+                            for f in files)
+            if not is_recursive:
+                break
+
+        assert actual == expected
+
+
+def test_get_next_file_lists_a_few_directories_ahead(tmpdir, monkeypatch):
+    for i in range(50):
+        tmpdir.join('d%02d' % i).ensure(dir=True).join('1.txt').write('1')
+
+    listed = []
+    list_dir = file_helper.list_dir
+
+    def counting_list_dir(directory_and_rules, path_filter=None):
+        listed.append(directory_and_rules)
+        return list_dir(directory_and_rules, path_filter)
+
+    monkeypatch.setattr(file_helper, 'walk_workers', 2)
+    monkeypatch.setattr(file_helper, 'list_dir', counting_list_dir)
+
+    files = file_helper.get_next_file(str(tmpdir), is_recursive=True)
+    next(files)
+    time.sleep(0.2)
+
+    # The root, the directory of the first file and at most
+    # 2 * walk_workers more subdirectories
+    assert len(listed) <= 6
+    assert len(list(files)) == 49
+
+
+def test_get_blocks_reads_stdin_as_it_arrives(monkeypatch):
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, b'first\nsec')
+
+    with os.fdopen(read_fd, 'rb') as stdin:
+        monkeypatch.setattr(sys, 'stdin', stdin)
+        blocks = file_helper.get_blocks(file_helper.stdin_path,
+                                         is_stdin=True)
+
+        # Available lines are generated before the stream ends
+        assert next(blocks) == b'first\n'
+
+        os.write(write_fd, b'ond\n')
+        os.close(write_fd)
+        assert list(blocks) == [b'second\n']
+
+
+def test_is_binary_block_with_sniff_encoding():
+    assert file_helper.is_binary_block(b'caf\xe9')
+    assert not file_helper.is_binary_block(b'caf\xe9', None)
+    assert file_helper.is_binary_block(b'caf\xe9\x00', None)
+
+
+def test_get_blocks_decompresses_files(tmpdir):
+    import bz2
+    import gzip
+
+    gzip_file = str(tmpdir.join('a.log.gz'))
+    with gzip.open(gzip_file, 'wb') as f:
+        f.write(b'first\nsecond\n')
+
+    bz2_file = str(tmpdir.join('b.log.bz2'))
+    with bz2.BZ2File(bz2_file, 'wb') as f:
+        f.write(b'third\n')
+
+    plain_file = tmpdir.join('c.log')
+    plain_file.write_binary(b'\x1f plain\n')
+
+    def read(file_path, decompress=True):
+        blocks = file_helper.get_blocks(file_path, decompress=decompress)
+        try:
+            return b''.join(block[:] for block in blocks)
+
+        finally:
+            blocks.close()
+
+    assert read(gzip_file) == b'first\nsecond\n'
+    assert read(bz2_file) == b'third\n'
+    assert read(str(plain_file)) == b'\x1f plain\n'
+    assert read(gzip_file, decompress=False).startswith(b'\x1f\x8b')
+
+
+def test_get_archive_members(tmpdir):
+    import tarfile
+    import zipfile
+
+    member = tmpdir.join('app.log')
+    member.write_binary(b'first\nsecond\n')
+
+    zip_file = str(tmpdir.join('bundle.zip'))
+    with zipfile.ZipFile(zip_file, 'w') as f:
+        f.write(str(member), 'logs/app.log')
+
+    tar_file = str(tmpdir.join('bundle.tar.gz'))
+    with tarfile.open(tar_file, 'w:gz') as f:
+        f.add(str(member), 'logs/app.log')
+
+    def read(archive_path):
+        return [(path, b''.join(block[:] for block in blocks))
+                for path, blocks in file_helper.get_archive_members(
+                    archive_path)]
+
+    assert read(zip_file) == [(zip_file + '!/logs/app.log',
+                               b'first\nsecond\n')]
+    assert read(tar_file) == [(tar_file + '!/logs/app.log',
+                               b'first\nsecond\n')]
+    assert file_helper.get_archive_members(str(member)) is None
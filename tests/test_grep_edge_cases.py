@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import io
 import os
 import platform
+import re
 import pytest
 
 from grep import print_helper
@@ -117,13 +119,13 @@ def test_ioerror_due_to_restricted_file(with_restricted_file):
             is_from_stdin=False))
 
 
-def test_regular_expression_error_file_level(with_f_read):
+def test_regular_expression_error_file_level():
     search_term = "[\\]"
     is_regex_pattern = True
     is_search_line_by_line = False
-    f = with_f_read.name
 
-    Searcher.search_f(
+    # Invalid patterns fail before any file is searched
+    with pytest.raises(re.error):
         Searcher(
             caller_dir='',
             specific_file='',
@@ -132,17 +134,16 @@ def test_regular_expression_error_file_level(with_f_read):
             is_abs_path=False,
             is_regex_pattern=is_regex_pattern,
             is_search_line_by_line=is_search_line_by_line,
-            is_from_stdin=False), f)
+            is_from_stdin=False)
 
 
-def test_regular_expression_error_line_by_line(with_f_read):
+def test_regular_expression_error_line_by_line():
     search_term = "[\\]"
     is_regex_pattern = True
     is_search_line_by_line = True
-    f = with_f_read.name
 
     # Directory option is irrelevant for the test.
-    Searcher.search_f(
+    with pytest.raises(re.error):
         Searcher(
             caller_dir='',
             search_term=search_term,
@@ -151,4 +152,56 @@ def test_regular_expression_error_line_by_line(with_f_read):
             is_abs_path=False,
             is_regex_pattern=is_regex_pattern,
             is_search_line_by_line=is_search_line_by_line,
-            is_from_stdin=False), f)
+            is_from_stdin=False)
+
+
+def test_file_named_dash_is_searched_as_a_file(tmpdir):
+    tmpdir.join('-').write('needle\n')
+
+    matched_files = Searcher(
+        caller_dir=str(tmpdir),
+        search_term='needle',
+        specific_file='',
+        is_recursive=False,
+        is_abs_path=True,
+        is_regex_pattern=False,
+        is_search_line_by_line=False,
+        is_from_stdin=False,
+        out=print_helper.BufferedWriter(io.BytesIO())).run()
+
+    assert matched_files == [str(tmpdir.join('-'))]
+
+
+@pytest.mark.skipif(platform.system() == 'Windows',
+                    reason='stdin is not searched on Windows')
+def test_given_file_is_searched_although_stdin_is_a_pipe(tmpdir):
+    import subprocess
+    import sys
+
+    tmpdir.join('a.txt').write('needle\n')
+
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'grep', '--color', 'never', 'needle',
+         'a.txt'],
+        cwd=str(tmpdir),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        env=dict(os.environ, PYTHONPATH=os.path.dirname(
+            os.path.dirname(os.path.abspath(__file__)))))
+    output, _ = process.communicate(b'hay\n')
+
+    assert output.decode('utf-8').splitlines() == ['a.txt:needle']
+
+
+@pytest.mark.parametrize('encoding', ['utf-16', 'utf-32'])
+def test_ascii_incompatible_encoding_is_rejected(encoding, monkeypatch,
+                                                 capsys):
+    from grep import __main__
+
+    monkeypatch.setattr('sys.argv', ['grep', '--encoding', encoding, 'foo'])
+
+    with pytest.raises(KeyboardInterrupt):
+        __main__.parse_command_line_options()
+
+    out, _ = capsys.readouterr()
+    assert out.startswith('encoding is not ASCII compatible: ' + encoding)
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 
-from grep.grep import Searcher
+import io
+
+from grep import file_helper
+from grep import print_helper
+from grep.grep import Match, Searcher
 from tests.helper_for_tests import *
 
 
@@ -49,23 +53,22 @@ def test_run(with_f_write):
     assert matched_files == [os.path.abspath(with_f_write.name)]
 
 
-def test_search_f(with_f_write):
+def test_line_dict(with_f_write):
     with_f_write.write('sdf\na\nrghsf')
     with_f_write.seek(0)
 
-    search_term = 'a'
-    matched_file = Searcher.search_f(
-        Searcher(
-            caller_dir='',
-            search_term=search_term,
-            specific_file='',
-            is_recursive=False,
-            is_abs_path=False,
-            is_regex_pattern=False,
-            is_search_line_by_line=True,
-            is_from_stdin=False), with_f_write.name)
+    searcher = Searcher(
+        caller_dir='',
+        search_term='a',
+        specific_file='',
+        is_recursive=False,
+        is_abs_path=False,
+        is_regex_pattern=False,
+        is_search_line_by_line=True,
+        is_from_stdin=False)
 
-    assert matched_file[with_f_write.name] == {2: 'a'}
+    assert searcher.line_dict(
+        searcher.iter_file_matches(with_f_write.name)) == {2: 'a'}
 
 
 def test_match_f_for_str(with_f_write):
@@ -143,7 +146,7 @@ def test_search_line_by_line_for_regex(with_f_write):
             specific_file='',
             is_recursive=False,
             is_abs_path=False,
-            is_regex_pattern=False,
+            is_regex_pattern=True,
             is_search_line_by_line=True,
             is_from_stdin=False), with_f_write.name)
 
@@ -238,3 +241,390 @@ def test_match_f_for_str_using_specific_file(with_f_write):
             is_from_stdin=False))
 
     assert matched_files == [os.path.abspath(with_f_write.name)]
+
+
+def test_run_with_multiple_workers(with_f_write):
+    with_f_write.write('docopt')
+    with_f_write.seek(0)
+
+    caller_dir = os.path.dirname(with_f_write.name)
+    search_term = 'docopt'
+
+    matched_files = Searcher.run(
+        Searcher(
+            caller_dir=caller_dir,
+            search_term=search_term,
+            specific_file='',
+            is_recursive=False,
+            is_abs_path=True,
+            is_regex_pattern=False,
+            is_search_line_by_line=True,
+            is_from_stdin=False,
+            workers=2))
+
+    assert matched_files == [os.path.abspath(with_f_write.name)]
+
+
+def test_match_f_for_pattern_matches_every_line(with_f_write):
+    with_f_write.write('foo bar\nbaz\nfoo\n')
+    with_f_write.seek(0)
+
+    matched_file = Searcher.match_f_for_pattern_wrapper(
+        Searcher(
+            caller_dir='',
+            search_term='^(foo|baz)$',
+            specific_file='',
+            is_recursive=False,
+            is_abs_path=False,
+            is_regex_pattern=True,
+            is_search_line_by_line=False,
+            is_from_stdin=False), with_f_write.name)
+
+    assert matched_file == {1: 'baz', 2: 'foo'}
+
+
+def test_search_line_by_line_in_chunks(with_f_write):
+    with_f_write.write('sdf\na\nrghsfz\n' * 3)
+    with_f_write.seek(0)
+
+    chunk_size = file_helper.chunk_size
+    mmap_max_size = file_helper.mmap_max_size
+    file_helper.chunk_size = 5
+    file_helper.mmap_max_size = 0
+    try:
+        matched_lines = Searcher.search_line_by_line_for_term_wrapper(
+            Searcher(
+                caller_dir='',
+                search_term='a',
+                specific_file='',
+                is_recursive=False,
+                is_abs_path=False,
+                is_regex_pattern=False,
+                is_search_line_by_line=True,
+                is_from_stdin=False), with_f_write.name)
+
+    finally:
+        file_helper.chunk_size = chunk_size
+        file_helper.mmap_max_size = mmap_max_size
+
+    assert matched_lines == {2: 'a', 5: 'a', 8: 'a'}
+
+
+def test_search_line_by_line_with_patterns(with_f_write):
+    with_f_write.write('sdf\na\nrghsfz\nxyz')
+    with_f_write.seek(0)
+
+    matched_lines = Searcher.search_line_by_line_wrapper(
+        Searcher(
+            caller_dir='',
+            search_term='',
+            specific_file='',
+            is_recursive=False,
+            is_abs_path=False,
+            is_regex_pattern=False,
+            is_search_line_by_line=True,
+            is_from_stdin=False,
+            patterns=['sd', 'hs', 'xyz']), with_f_write.name)
+
+    assert matched_lines == {1: 'sd', 3: 'rghsf', 4: 'xyz'}
+
+
+def test_search_line_by_line_trims_non_ascii_lines(with_f_bwrite):
+    # Cut short after two bytes, the second \xe9 would be split
+    with_f_bwrite.write(u'x' * 600 + u'caf\xe9\nbar\xe9\xe9\nlast a\n')
+    with_f_bwrite.seek(0)
+
+    matched_lines = Searcher.search_line_by_line_wrapper(
+        Searcher(
+            caller_dir='',
+            search_term='a',
+            specific_file='',
+            is_recursive=False,
+            is_abs_path=False,
+            is_regex_pattern=False,
+            is_search_line_by_line=True,
+            is_from_stdin=False,
+            encoding='utf-8'), with_f_bwrite.name)
+
+    assert matched_lines == {1: u'x' * 600 + u'caf\xe9',
+                             2: u'bar\xe9', 3: 'last'}
+
+
+def test_iter_matches(with_f_write):
+    with_f_write.write('a\nb\nbaba\n')
+    with_f_write.seek(0)
+
+    searcher = Searcher(
+        caller_dir='',
+        search_term='a',
+        specific_file=with_f_write.name,
+        is_recursive=False,
+        is_abs_path=False,
+        is_regex_pattern=False,
+        is_search_line_by_line=True,
+        is_from_stdin=False)
+    matches = searcher.iter_matches()
+
+    # Matches are generated one at a time
+    assert next(matches) == Match(0, 1, 0, [(0, 1)], 'a')
+    assert list(matches) == [Match(0, 3, 4, [(1, 2), (3, 4)], 'bab')]
+    assert searcher.paths == [with_f_write.name]
+
+
+def test_iter_matches_with_binary_file(with_f_bwrite):
+    matches = list(
+        Searcher(
+            caller_dir='',
+            search_term='',
+            specific_file=with_f_bwrite.name,
+            is_recursive=False,
+            is_abs_path=False,
+            is_regex_pattern=True,
+            is_search_line_by_line=True,
+            is_from_stdin=False).iter_matches())
+
+    assert len(matches) == 1
+    assert matches[0].is_binary
+
+
+def test_max_count_stops_after_num_lines(with_f_write):
+    with_f_write.write('a\na\na\n')
+    with_f_write.seek(0)
+
+    matches = list(
+        Searcher(
+            caller_dir='',
+            search_term='a',
+            specific_file=with_f_write.name,
+            is_recursive=False,
+            is_abs_path=False,
+            is_regex_pattern=False,
+            is_search_line_by_line=True,
+            is_from_stdin=False,
+            max_count=2).iter_matches())
+
+    assert [match.line_num for match in matches] == [1, 2]
+
+
+def test_list_files(tmpdir):
+    tmpdir.join('a.txt').write('needle\nneedle\n')
+    tmpdir.join('b.txt').write('hay\n')
+
+    def run(**kwargs):
+        out = print_helper.BufferedWriter(io.BytesIO())
+        return Searcher(
+            caller_dir=str(tmpdir),
+            search_term='needle',
+            specific_file='',
+            is_recursive=False,
+            is_abs_path=True,
+            is_regex_pattern=False,
+            is_search_line_by_line=False,
+            is_from_stdin=False,
+            out=out,
+            **kwargs).run()
+
+    assert run(list_files='with_matches') == [str(tmpdir.join('a.txt'))]
+    assert run(list_files='without_match') == [str(tmpdir.join('b.txt'))]
+    assert len(run(is_quiet=True)) == 1
+
+
+def test_count_file(with_f_write):
+    with_f_write.write('abab\nb\nab\n')
+    with_f_write.seek(0)
+
+    def count(search_term, is_regex_pattern, count_mode, max_count=None):
+        return Searcher(
+            caller_dir='',
+            search_term=search_term,
+            specific_file='',
+            is_recursive=False,
+            is_abs_path=False,
+            is_regex_pattern=is_regex_pattern,
+            is_search_line_by_line=False,
+            is_from_stdin=False,
+            max_count=max_count,
+            count_mode=count_mode).count_file(with_f_write.name)
+
+    assert count('ab', False, 'lines') == 2
+    assert count('ab', False, 'matches') == 3
+    assert count('a.', True, 'matches') == 3
+    assert count('ab', False, 'matches', max_count=1) == 2
+
+
+def test_search_with_encoding_and_errors(tmpdir):
+    latin_file = tmpdir.join('latin.log')
+    latin_file.write_binary(b'caf\xe9 error\nok\n')
+
+    def search(search_term, **kwargs):
+        return Searcher.search_line_by_line_wrapper(
+            Searcher(
+                caller_dir='',
+                search_term=search_term,
+                specific_file='',
+                is_recursive=False,
+                is_abs_path=False,
+                is_regex_pattern=False,
+                is_search_line_by_line=True,
+                is_from_stdin=False,
+                **kwargs), str(latin_file))
+
+    # Not ascii, so binary unless an encoding or error handler is given
+    assert search('error') == {print_helper.binary_match_key: ''}
+    assert search(u'caf\xe9', encoding='latin-1') == {1: u'caf\xe9 err'}
+    assert search('error', errors='replace') == {1: u'caf� error'}
+
+
+def test_search_archives(tmpdir):
+    import zipfile
+
+    zip_file = str(tmpdir.join('bundle.zip'))
+    with zipfile.ZipFile(zip_file, 'w') as f:
+        f.writestr('a.log', 'needle\n')
+        f.writestr('b.log', 'hay\n')
+
+    def run(**kwargs):
+        out = print_helper.BufferedWriter(io.BytesIO())
+        return Searcher(
+            caller_dir=str(tmpdir),
+            search_term='needle',
+            specific_file='',
+            is_recursive=False,
+            is_abs_path=True,
+            is_regex_pattern=False,
+            is_search_line_by_line=False,
+            is_from_stdin=False,
+            out=out,
+            search_archives=True,
+            **kwargs).run()
+
+    assert run() == [zip_file + '!/a.log']
+    assert run(list_files='without_match') == [zip_file + '!/b.log']
+    assert run(count_mode='lines') == [zip_file + '!/a.log']
+
+
+def test_iter_matches_with_context(with_f_write):
+    with_f_write.write('a\nneedle\nb\nc\nd\nneedle\ne\nf\nneedle\n')
+    with_f_write.seek(0)
+
+    searcher = Searcher(
+        caller_dir='',
+        search_term='needle',
+        specific_file=with_f_write.name,
+        is_recursive=False,
+        is_abs_path=True,
+        is_regex_pattern=False,
+        is_search_line_by_line=True,
+        is_from_stdin=False,
+        before_context=2,
+        after_context=1)
+
+    def context(blocks=None):
+        return [(match.line_num, match.is_context)
+                for match in searcher.iter_file_matches(
+                    with_f_write.name, blocks=blocks)]
+
+    expected = [(1, True), (2, False), (3, True), (4, True), (5, True),
+                (6, False), (7, True), (8, True), (9, False)]
+    assert context() == expected
+    # Lines before a match at the start of a block come from the last one
+    blocks = [b'a\nneedle\nb\nc\nd\n', b'needle\ne\nf\n', b'needle\n']
+    assert context(block for block in blocks) == expected
+
+    searcher.max_count = 1
+    assert context() == [(1, True), (2, False), (3, True)]
+
+
+def test_regex_does_not_match_across_lines(with_f_write):
+    with_f_write.write('xa\nb ok\nab\na b\n')
+    with_f_write.seek(0)
+
+    def line_nums(pattern, blocks=None):
+        searcher = Searcher(
+            caller_dir='',
+            search_term=pattern,
+            specific_file=with_f_write.name,
+            is_recursive=False,
+            is_abs_path=False,
+            is_regex_pattern=True,
+            is_search_line_by_line=True,
+            is_from_stdin=False)
+
+        return [match.line_num for match in searcher.iter_file_matches(
+            with_f_write.name, blocks=blocks)]
+
+    assert line_nums(r'a\sb') == [4]
+    assert line_nums(r'[^a]b') == [4]
+    assert line_nums(r'a\nb') == []
+    # Chunk boundaries don't change what matches
+    blocks = [b'xa\n', b'b ok\nab\n', b'a b\n']
+    assert line_nums(r'a\sb', (block for block in blocks)) == [4]
+    assert line_nums(r'^$', (block for block in blocks)) == []
+
+
+def test_search_without_line_numbers_does_not_match_across_lines(
+        with_f_write):
+    with_f_write.write('xa\nb ok\na b\n')
+    with_f_write.seek(0)
+
+    searcher = Searcher(
+        caller_dir='',
+        search_term=r'a\sb',
+        specific_file=with_f_write.name,
+        is_recursive=False,
+        is_abs_path=False,
+        is_regex_pattern=True,
+        is_search_line_by_line=False,
+        is_from_stdin=False)
+
+    blocks = [b'xa\n', b'b ok\n', b'a b\n']
+    for matches in (searcher.iter_file_matches(with_f_write.name),
+                    searcher.iter_file_matches(
+                        with_f_write.name,
+                        blocks=(block for block in blocks))):
+        assert [match.line for match in matches] == ['a b']
+
+
+def test_iter_matches_reports_the_found_patterns(with_f_write):
+    with_f_write.write('fatal error\nok\nwarn\n')
+    with_f_write.seek(0)
+
+    for is_regex_pattern in (False, True):
+        searcher = Searcher(
+            caller_dir='',
+            search_term='',
+            specific_file=with_f_write.name,
+            is_recursive=False,
+            is_abs_path=False,
+            is_regex_pattern=is_regex_pattern,
+            is_search_line_by_line=True,
+            is_from_stdin=False,
+            patterns=['error', 'warn', 'fatal'])
+
+        assert [(match.line_num, match.pattern_ids)
+                for match in searcher.iter_matches()] == [(1, [2, 0]),
+                                                          (3, [1])]
+
+
+def test_show_patterns_prints_the_found_patterns(tmpdir, monkeypatch):
+    monkeypatch.setattr(print_helper, 'use_color', False)
+    tmpdir.join('a.log').write('fatal error\nok\nwarn warn\n')
+
+    stream = io.BytesIO()
+    Searcher(
+        caller_dir='',
+        search_term='',
+        specific_file=str(tmpdir.join('a.log')),
+        is_recursive=False,
+        is_abs_path=True,
+        is_regex_pattern=False,
+        is_search_line_by_line=False,
+        is_from_stdin=False,
+        patterns=['error', 'warn', 'fatal'],
+        out=print_helper.BufferedWriter(stream),
+        show_patterns=True).run()
+
+    path = str(tmpdir.join('a.log'))
+    assert stream.getvalue().decode('utf-8').splitlines() == [
+        path + ':fatal,error:fatal error',
+        path + ':warn:warn warn']
@@ -0,0 +1,70 @@
+import os
+
+from grep import index
+from grep.grep import Searcher
+
+
+def make_tree(tmpdir):
+    tree = tmpdir.mkdir('tree')
+    tree.join('a.txt').write('needle in a haystack\n')
+    tree.join('b.txt').write('just hay\n')
+    tree.join('c.txt').write('more hay\n')
+
+    return str(tree)
+
+
+def make_searcher(caller_dir, search_term, index_path, is_regex_pattern=False):
+    return Searcher(
+        caller_dir=caller_dir,
+        search_term=search_term,
+        specific_file='',
+        is_recursive=True,
+        is_abs_path=False,
+        is_regex_pattern=is_regex_pattern,
+        is_search_line_by_line=True,
+        is_from_stdin=False,
+        index_path=index_path)
+
+
+def test_build_and_load_index(tmpdir):
+    caller_dir = make_tree(tmpdir)
+    index_path = str(tmpdir.join('index', 'index.json'))
+
+    index.build_index(caller_dir, True, index_path)
+    loaded_index = index.load_index(index_path)
+
+    assert loaded_index.candidates([[b'needle']]) == set(['a.txt'])
+    assert loaded_index.candidates([[b'hay']]) == set(
+        ['a.txt', 'b.txt', 'c.txt'])
+    assert loaded_index.candidates([[b'ha']]) is None
+
+
+def test_index_only_yields_candidates(tmpdir):
+    caller_dir = make_tree(tmpdir)
+    index_path = str(tmpdir.join('index.json'))
+    index.build_index(caller_dir, True, index_path)
+
+    searcher = make_searcher(caller_dir, 'ne+dle', index_path, True)
+
+    assert searcher.get_files() == [os.path.join(caller_dir, 'a.txt')]
+
+
+def test_stale_index_falls_back_to_full_search(tmpdir):
+    caller_dir = make_tree(tmpdir)
+    index_path = str(tmpdir.join('index.json'))
+    index.build_index(caller_dir, True, index_path)
+
+    tmpdir.join('tree', 'd.txt').write('another needle\n')
+    searcher = make_searcher(caller_dir, 'needle', index_path)
+
+    assert sorted(searcher.run()) == [
+        os.path.join(caller_dir, 'a.txt'),
+        os.path.join(caller_dir, 'd.txt')
+    ]
+
+
+def test_missing_index_falls_back_to_full_search(tmpdir):
+    caller_dir = make_tree(tmpdir)
+    searcher = make_searcher(caller_dir, 'needle', str(tmpdir.join('none')))
+
+    assert searcher.run() == [os.path.join(caller_dir, 'a.txt')]
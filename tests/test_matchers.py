@@ -0,0 +1,133 @@
+from grep import matchers
+
+
+def test_aho_corasick_finds_overlapping_terms():
+    matcher = matchers.AhoCorasickMatcher([b'he', b'she', b'his', b'hers'])
+
+    actual = sorted(matcher.scan(b'ushers'))
+
+    assert actual == [(1, 1), (2, 0), (2, 3)]
+
+
+def test_aho_corasick_find_starts_at_pos():
+    matcher = matchers.AhoCorasickMatcher([b'abc', b'xyz'])
+
+    assert matcher.find(b'abc\nxyz\n', 1) == 4
+    assert matcher.find(b'abc\nxyz\n', 5) == -1
+
+
+def test_aho_corasick_runs_from_the_first_match():
+    assert matchers._trie_pattern([b'ab', b'abc', b'abd', b'e']) == (
+        b'(?:ab(?:c|d)?|e)')
+
+    terms = [b'ab', b'abc', b'b', b'cab', b'x.']
+    block = b'zzcabcx\nq\nx.ab\n'
+    matcher = matchers.AhoCorasickMatcher(terms)
+    automaton = matchers.AhoCorasickMatcher(terms)
+    automaton.prefilter = None
+
+    assert matcher.prefilter is not None
+    assert matcher.find(block, 0) == 2
+    assert matcher.find(block, 7) == 10
+    assert matcher.find(block, 15) == -1
+    for start, end in ((0, 7), (8, 9), (10, 14)):
+        assert (matcher.pattern_spans(block, start, end) ==
+                automaton.pattern_spans(block, start, end))
+
+
+def test_pattern_spans():
+    matcher = matchers.AhoCorasickMatcher([b'error', b'warn', b'fatal'])
+
+    actual = matcher.pattern_spans(b'fatal error: disk full', 0, 22)
+
+    assert actual == [(0, 5, 2), (6, 11, 0)]
+
+    matcher = matchers.make_matcher('', True, patterns=['b+', 'a|b'])
+
+    assert matcher.pattern_spans(b'abbx\n', 0, 4) == [(0, 1, 1), (1, 3, 0)]
+
+
+def test_make_matcher_with_regex_patterns():
+    matcher = matchers.make_matcher('', True, patterns=['^a+$', 'b|c'])
+
+    assert matcher.find(b'xyz\naaa\n', 0) == 4
+    assert matcher.find(b'xyz\nc\n', 0) == 4
+
+
+def test_analyse_pattern_finds_required_literal():
+    assert matchers.analyse_pattern(b'foo\\d+barbaz') == (b'barbaz', True)
+    assert matchers.analyse_pattern(b'(?:ab)+c?') == (b'ab', True)
+
+
+def test_analyse_pattern_without_required_literal():
+    assert matchers.analyse_pattern(b'foo|bar') == (None, True)
+    assert matchers.analyse_pattern(b'(?i)foo') == (None, True)
+    assert matchers.analyse_pattern(b'x?y*') == (None, True)
+
+
+def test_analyse_pattern_spanning_lines():
+    assert matchers.analyse_pattern(b'foo\\s+bar') == (b'foo', False)
+    assert matchers.analyse_pattern(b'(?s)foo.*') == (b'foo', False)
+
+
+def test_regex_matcher_skips_lines_without_literal():
+    matcher = matchers.RegexMatcher(b'^ex\\w*r$')
+
+    block = b'exit 1\nerror\nwarn\nexpr\n'
+
+    assert matcher.find(block, 0) == 18
+    assert matcher.find(block, 19) == -1
+
+
+def test_spans_stay_inside_the_range():
+    block = b'abab\nab\n'
+
+    assert matchers.LiteralMatcher(b'ab').spans(block, 0, 4) == [(0, 2),
+                                                                (2, 4)]
+    assert matchers.RegexMatcher(b'b$').spans(block, 0, 4) == [(3, 4)]
+    assert matchers.AhoCorasickMatcher([b'ba', b'b']).spans(
+        block, 1, 4) == [(1, 2), (1, 3), (3, 4)]
+
+
+def test_regex_matches_characters_of_non_ascii_text():
+    text = u'caf\xe9\nCAF\xc9\n'.encode('utf-8')
+
+    def lines(pattern):
+        matcher = matchers.make_matcher(pattern, True, encoding='utf-8')
+        found = []
+        pos = matcher.find(text, 0)
+        while pos >= 0:
+            found.append(text.rfind(b'\n', 0, pos) + 1)
+            pos = matcher.find(text, text.find(b'\n', pos) + 1)
+
+        return found
+
+    assert lines(u'(?i)CAF\xc9') == [0, 6]
+    assert lines(u'^.{4}$') == [0, 6]
+    assert lines(u'^.{5}$') == []
+    assert lines(u'\\w$') == [0, 6]
+    assert matchers.make_matcher(u'(?i)\xe9', True, encoding='utf-8').spans(
+        text, 0, 5) == [(3, 5)]
+
+
+def test_line_end_matches_before_carriage_return():
+    text = u'foo bar\r\nbaz\r\n\r\ncaf\xe9\r\nqux bar\n'.encode('utf-8')
+
+    def lines(pattern):
+        matcher = matchers.make_matcher(pattern, True, encoding='utf-8')
+        found = []
+        pos = matcher.find(text, 0)
+        while pos >= 0:
+            line_start = text.rfind(b'\n', 0, pos) + 1
+            line_end = text.find(b'\n', pos)
+            found.append((line_start,
+                          matcher.spans(text, line_start, line_end)))
+            pos = matcher.find(text, line_end + 1)
+
+        return found
+
+    assert lines(u'bar$') == [(0, [(4, 7)]), (23, [(27, 30)])]
+    assert lines(u'^$') == [(14, [(14, 14)])]
+    assert lines(u'(?:ba[rz]|\\w)$') == [(0, [(4, 7)]), (9, [(9, 12)]),
+                                        (16, [(19, 21)]), (23, [(27, 30)])]
+    assert lines(u'r.$') == []
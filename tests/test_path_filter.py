@@ -0,0 +1,52 @@
+import os
+
+from grep import file_helper
+from grep.path_filter import PathFilter, translate_ignore_pattern
+
+
+def make_tree(tmpdir):
+    tmpdir.join('.gitignore').write('build/\n*.log\n!keep.log\n/top.txt\n')
+    for path in ('src/a.py', 'src/b.log', 'src/keep.log', 'src/top.txt',
+                 'top.txt', 'build/c.py', '.git/d', 'lib/x/e.js'):
+        tmpdir.join(*path.split('/')).write('needle', ensure=True)
+
+    return str(tmpdir)
+
+
+def walk(caller_dir, path_filter):
+    return sorted(
+        os.path.relpath(f, caller_dir)
+        for f in file_helper.get_next_file(caller_dir, True, path_filter))
+
+
+def test_translate_ignore_pattern():
+    assert translate_ignore_pattern('*.log').match('a/b/c.log')
+    assert translate_ignore_pattern('/top.txt').match('top.txt')
+    assert not translate_ignore_pattern('/top.txt').match('src/top.txt')
+    assert translate_ignore_pattern('a/**/b').match('a/x/y/b')
+    assert translate_ignore_pattern('a/**/b').match('a/b')
+
+
+def test_ignore_files_prune_walk(tmpdir):
+    caller_dir = make_tree(tmpdir)
+
+    actual = walk(caller_dir, PathFilter(use_ignore_files=True))
+
+    assert actual == [
+        '.gitignore',
+        os.path.join('lib', 'x', 'e.js'),
+        os.path.join('src', 'a.py'),
+        os.path.join('src', 'keep.log'),
+        os.path.join('src', 'top.txt'),
+    ]
+
+
+def test_include_exclude_globs(tmpdir):
+    caller_dir = make_tree(tmpdir)
+
+    actual = walk(
+        caller_dir,
+        PathFilter(
+            include=['*.py', '*.js'], exclude=['a.*'], exclude_dir=['lib']))
+
+    assert actual == [os.path.join('build', 'c.py')]
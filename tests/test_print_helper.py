@@ -1,3 +1,4 @@
+import io
 import os
 import tempfile
 import platform
@@ -125,6 +126,89 @@ def test_printing_for_searching_stdin_abs_path():
     assert actual == test_output
 
 
+def test_output_binary_file_matches_without_opening_file():
+    matched_items = {'/nonexistent/binary': {'file_matched': ''}}
+
+    test_output = ['Binary file /nonexistent/binary matches']
+    actual = print_helper.generate_output_for_matched_files_full_path(
+        matched_items,
+        search_term='aware',
+        is_from_stdin=False,
+        is_line_by_line=False)
+
+    assert actual == test_output
+
+
+def test_generate_output_without_color():
+    matched_items = {'/home/flo/Untitled Document': {1: 'aware\n'}}
+
+    print_helper.set_color('never')
+    try:
+        actual = print_helper.generate_output_for_matched_files_full_path(
+            matched_items,
+            search_term='aware',
+            is_from_stdin=False,
+            is_line_by_line=True)
+
+    finally:
+        print_helper.set_color('always')
+
+    assert actual == ['/home/flo/Untitled Document:1:aware']
+
+
+def test_generate_output_for_context_line():
+    out = print_helper.BufferedWriter(io.BytesIO())
+
+    print_helper.set_color('never')
+    try:
+        actual = print_helper.generate_output_for_context_line(
+            '/home/flo/a.txt', 3, 'before', is_abs_path=True,
+            is_from_stdin=False, is_line_by_line=True, out=out)
+
+    finally:
+        print_helper.set_color('always')
+
+    assert actual == '/home/flo/a.txt-3-before'
+
+
+def test_buffered_writer_writes_in_blocks():
+    stream = io.BytesIO()
+    writer = print_helper.BufferedWriter(stream)
+
+    writer.write_line('first')
+    writer.write_line('second')
+    assert stream.getvalue() == b''
+
+    writer.flush()
+    assert stream.getvalue() == b'first\nsecond\n'
+
+
+def test_line_buffered_writer_writes_every_line():
+    stream = io.BytesIO()
+    writer = print_helper.BufferedWriter(stream, line_buffered=True)
+
+    writer.write_line('first')
+    assert stream.getvalue() == b'first\n'
+
+
+@pytest.mark.skipif(platform.system() == 'Windows',
+                    reason='no broken pipes on Windows')
+def test_buffered_writer_exits_once_nobody_reads():
+    read_fd, write_fd = os.pipe()
+    os.close(read_fd)
+
+    with os.fdopen(write_fd, 'wb') as stream:
+        writer = print_helper.BufferedWriter(stream)
+        writer.write_line('first')
+        with pytest.raises(IOError):
+            writer.flush()
+
+        writer = print_helper.BufferedWriter(stream, exit_on_broken_pipe=True)
+        writer.write_line('first')
+        with pytest.raises(SystemExit):
+            writer.flush()
+
+
 # TODO do not call hotfix_delete_temp_dir manually
 def test_hotfix_delete_temp_dir(hotfix_delete_temp_dir):
     pass
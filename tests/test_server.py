@@ -0,0 +1,87 @@
+import io
+import os
+import threading
+import pytest
+
+from grep import server
+
+
+@pytest.mark.skipif("not hasattr(__import__('socket'), 'AF_UNIX')")
+def test_query_is_answered_by_server(tmpdir):
+    tree = tmpdir.mkdir('tree')
+    tree.join('a.txt').write('needle\nhay\n')
+    tree.join('b.txt').write('hay\n')
+
+    socket_path = str(tmpdir.join('socket'))
+    search_server = server.SearchServer(socket_path)
+    thread = threading.Thread(target=search_server.serve_forever)
+    thread.start()
+
+    cwd = os.getcwd()
+    outputs = []
+    try:
+        for _ in range(2):
+            out = io.BytesIO()
+            server.query(
+                socket_path,
+                out=out,
+                caller_dir=str(tree),
+                search_term='needle',
+                specific_file='',
+                is_recursive=True,
+                is_abs_path=True,
+                is_regex_pattern=False,
+                is_search_line_by_line=True)
+            outputs.append(out.getvalue())
+
+    finally:
+        os.chdir(cwd)
+        search_server.shutdown()
+        search_server.server_close()
+        thread.join()
+
+    expected = ('\x1b[0;35m' + str(tree.join('a.txt')) +
+                '\x1b[0m\x1b[0;32m:\x1b[0m\x1b[0;32m1\x1b[0m\x1b[0;32m:'
+                '\x1b[0m\x1b[1;31mneedle\x1b[0m\n').encode('utf-8')
+
+    assert outputs == [expected, expected]
+
+
+@pytest.mark.skipif("not hasattr(__import__('socket'), 'AF_UNIX')")
+def test_invalid_pattern_is_raised_by_query(tmpdir):
+    import re
+
+    socket_path = str(tmpdir.join('socket'))
+    search_server = server.SearchServer(socket_path)
+    thread = threading.Thread(target=search_server.serve_forever)
+    thread.start()
+
+    cwd = os.getcwd()
+    try:
+        with pytest.raises(re.error):
+            server.query(
+                socket_path,
+                out=io.BytesIO(),
+                caller_dir=str(tmpdir),
+                search_term='[',
+                specific_file='',
+                is_recursive=False,
+                is_abs_path=True,
+                is_regex_pattern=True,
+                is_search_line_by_line=False)
+
+    finally:
+        os.chdir(cwd)
+        search_server.shutdown()
+        search_server.server_close()
+        thread.join()
+
+
+def test_serve_does_not_remove_other_files(tmpdir):
+    notes = tmpdir.join('notes.txt')
+    notes.write('keep me\n')
+
+    with pytest.raises(OSError):
+        server.serve(str(notes))
+
+    assert notes.read() == 'keep me\n'
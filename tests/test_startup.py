@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+import pytest
+
+# Modules only some searches need, importing them slows down every start
+lazy_modules = ('multiprocessing', 'concurrent.futures', 'json', 'hashlib',
+                'tempfile', 'platform', 'select', 'socket', 'grep.index',
+                'grep.server', 'grep.watcher')
+
+# Modules of the standard library grep.__main__ can't do without
+needed_modules = ('codecs', 'collections', 'errno', 'fnmatch', 'getopt', 'io',
+                  'itertools', 'mmap', 'os', 're', 'stat', 'time')
+
+# How many times as long as importing needed_modules importing the modules
+# of grep may take, it took 5.3 times as long before they were lazy
+import_time_ratio = 4
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(*args):
+    return subprocess.check_output(
+        (sys.executable, ) + args,
+        cwd=package_dir,
+        stderr=subprocess.STDOUT).decode('utf-8')
+
+
+def test_heavy_modules_are_imported_lazily():
+    output = run_python(
+        '-c', 'import sys, grep.__main__; print(" ".join(sys.modules))')
+
+    assert set(lazy_modules) & set(output.split()) == set()
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7),
+                    reason='python -X importtime needs Python 3.7')
+def test_import_time_budget():
+
+    def import_time_ratio_of_grep():
+        # Measured in the same run, a slow machine is slow for both
+        output = run_python(
+            '-X', 'importtime', '-c',
+            'import ' + ', '.join(needed_modules) + '; import grep.__main__')
+
+        needed_time = 0
+        grep_time = 0
+        for line in output.splitlines():
+            if not line.startswith('import time:'):
+                continue
+
+            _, cumulative, name = line.split('|')
+            # Only modules imported directly, they include the others
+            if len(name) - len(name.lstrip()) != 1:
+                continue
+
+            if name.strip() in needed_modules:
+                needed_time += int(cumulative)
+            elif name.strip().split('.')[0] == 'grep':
+                grep_time += int(cumulative)
+
+        return float(grep_time) / needed_time
+
+    # The fastest of a few runs, the others may have been interrupted
+    assert min(import_time_ratio_of_grep()
+               for _ in range(3)) < import_time_ratio
@@ -0,0 +1,58 @@
+import io
+
+from grep import print_helper
+from grep import stats
+from grep.grep import Searcher
+
+
+def test_stats_of_a_search(tmpdir):
+    tmpdir.join('a.txt').write('needle\nhay\nneedle\n')
+    tmpdir.join('b.txt').write('hay\n')
+
+    finished = []
+    stats.add_hook(finished.append)
+    collected = stats.enable()
+    try:
+        Searcher(
+            caller_dir=str(tmpdir),
+            search_term='needle',
+            specific_file='',
+            is_recursive=False,
+            is_abs_path=True,
+            is_regex_pattern=False,
+            is_search_line_by_line=True,
+            is_from_stdin=False,
+            out=print_helper.BufferedWriter(io.BytesIO())).run()
+
+    finally:
+        stats.disable()
+        stats.remove_hook(finished.append)
+
+    assert finished == [collected]
+    assert collected.counters == {
+        'files_walked': 2,
+        'files_skipped': 0,
+        'files_searched': 2,
+        'files_matched': 1,
+        'lines_matched': 2,
+        'bytes_read': 22
+    }
+    assert set(collected.seconds) == set(
+        ['walking', 'opening', 'matching', 'decoding', 'binary_sniffing',
+         'printing', 'total'])
+
+
+def test_merge_adds_up_stats():
+    first = stats.Stats()
+    first.count('bytes_read', 3)
+    first.add_time('matching', 1.0)
+    second = stats.Stats()
+    second.count('bytes_read', 4)
+    second.count('files_searched')
+
+    first.merge(second)
+
+    assert first.to_dict() == {
+        'counters': {'bytes_read': 7, 'files_searched': 1},
+        'seconds': {'matching': 1.0}
+    }
@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+import pytest
+
+from grep import index
+from grep import watcher
+
+
+def make_tree(tmpdir):
+    tree = tmpdir.mkdir('tree')
+    tree.join('a.txt').write('needle\n')
+    tree.join('b.txt').write('hay\n')
+
+    return tree
+
+
+def test_polling_watcher_finds_changes(tmpdir):
+    tree = make_tree(tmpdir)
+    polling_watcher = watcher.PollingWatcher(str(tree), True)
+
+    tree.join('a.txt').remove()
+    tree.join('b.txt').write('needle in the hay\n')
+    tree.mkdir('sub').join('c.txt').write('needle\n')
+
+    changed, _ = polling_watcher.wait_for_changes(0)
+
+    assert changed == set(['a.txt', 'b.txt', os.path.join('sub', 'c.txt')])
+
+
+@pytest.mark.skipif("not sys.platform.startswith('linux')")
+def test_inotify_watcher_finds_changes(tmpdir):
+    tree = make_tree(tmpdir)
+    inotify_watcher = watcher.InotifyWatcher(str(tree), True)
+    try:
+        tree.join('a.txt').remove()
+        tree.mkdir('sub')
+        changed, _ = inotify_watcher.wait_for_changes(1)
+
+        tree.join('sub', 'c.txt').write('needle\n')
+        more_changed, _ = inotify_watcher.wait_for_changes(1)
+
+    finally:
+        inotify_watcher.close()
+
+    assert changed == set(['a.txt'])
+    assert more_changed == set([os.path.join('sub', 'c.txt')])
+
+
+def test_apply_changes_updates_index(tmpdir):
+    tree = make_tree(tmpdir)
+    caller_dir = str(tree)
+    loaded_index = index.build_index(caller_dir, True,
+                                     str(tmpdir.join('index.json')))
+
+    tree.join('a.txt').remove()
+    tree.join('b.txt').write('needle in the hay\n')
+    watcher.apply_changes(loaded_index, caller_dir, set(['a.txt', 'b.txt']),
+                          set())
+
+    assert loaded_index.candidates([[b'needle']]) == set(['b.txt'])
+    assert loaded_index.is_fresh(
+        caller_dir, True,
+        index.get_file_stats(caller_dir, [str(tree.join('b.txt'))]))
+
+
+def test_compact_keeps_postings(tmpdir):
+    tree = make_tree(tmpdir)
+    caller_dir = str(tree)
+    loaded_index = index.build_index(caller_dir, True,
+                                     str(tmpdir.join('index.json')))
+
+    loaded_index.update_file(caller_dir, 'a.txt')
+    loaded_index.update_file(caller_dir, 'b.txt')
+    loaded_index.compact()
+
+    assert len(loaded_index.files) == 2
+    assert loaded_index.candidates([[b'needle']]) == set(['a.txt'])
+    assert loaded_index.candidates([[b'hay']]) == set(['b.txt'])
+
+
+def test_watch_writes_batches_while_files_keep_changing(tmpdir, monkeypatch):
+    tree = make_tree(tmpdir)
+    index_path = str(tmpdir.join('index.json'))
+    index.build_index(str(tree), True, index_path)
+
+    class BusyWatcher(object):
+        """Reports a change on every poll, like a log being appended to."""
+
+        def wait_for_changes(self, timeout):
+            time.sleep(0.01)
+            return set(['a.txt']), set()
+
+        def close(self):
+            pass
+
+    writes = []
+
+    def write_index(loaded_index, path):
+        writes.append(path)
+        if len(writes) == 2:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(watcher, 'batch_max_age', 0.1)
+    monkeypatch.setattr(index, 'write_index', write_index)
+
+    with pytest.raises(KeyboardInterrupt):
+        watcher.watch(str(tree), True, index_path, watcher=BusyWatcher())
+
+    assert writes == [index_path, index_path]